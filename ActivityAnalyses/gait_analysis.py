@@ -25,7 +25,6 @@ import numpy as np
 import copy
 import pandas as pd
 from scipy.signal import find_peaks
-from matplotlib import pyplot as plt
 
 from utilsKinematics import kinematics
 
@@ -675,6 +674,7 @@ class gait_analysis(kinematics):
         
                         # Plotting the signals if visualize is True
                         if visualize:
+                            import matplotlib.pyplot as plt
                             plt.figure(figsize=(8, 5))
                             plt.plot(signal1, label='df1')
                             plt.plot(signal2, label='df2')
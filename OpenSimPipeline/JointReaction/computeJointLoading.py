@@ -22,6 +22,8 @@ import numpy as np
 import copy
 import glob
 
+from utilsModelCache import get_model
+
 #%% Compute knee adduction moments.
 def computeKAM(pathGenericTemplates, outputDir, modelPath, IDPath, IKPath,
                GRFPath, grfType, contactSides, contactSpheres={}, Qds=[]):
@@ -35,7 +37,7 @@ def computeKAM(pathGenericTemplates, outputDir, modelPath, IDPath, IKPath,
       
     # Load model
     opensim.Logger.setLevelString('error')
-    model = opensim.Model(modelPath)
+    model = get_model(modelPath, initSystem=False)
     
     # Remove all actuators and add coordinate actuators.                                         
     forceSet = model.getForceSet()
@@ -310,7 +312,7 @@ def computeMCF(pathGenericTemplates, outputDir, modelPath, activationsPath,
         
         # Load model.
         opensim.Logger.setLevelString('error')
-        model = opensim.Model(modelPath)
+        model = get_model(modelPath, initSystem=False)
         
         # Remove spheres.                              
         forceSet = model.getForceSet()        
@@ -34,18 +34,18 @@ def getMTParameters(pathModel, muscles, loadMTParameters,
             '{}_mtParameters_{}.npy'.format(modelName, side)),
             allow_pickle=True)
     else:   
-        import opensim
-        model = opensim.Model(pathModel)
+        from utilsModelCache import checkout_model
         mtParameters = np.zeros([5,len(muscles)])
-        model_muscles = model.getMuscles()
-        for i in range(len(muscles)):
-           muscle = model_muscles.get(muscles[i])
-           mtParameters[0,i] = muscle.getMaxIsometricForce()
-           mtParameters[1,i] = muscle.getOptimalFiberLength()
-           mtParameters[2,i] = muscle.getTendonSlackLength()
-           mtParameters[3,i] = muscle.getPennationAngleAtOptimalFiberLength()
-           mtParameters[4,i] = (muscle.getMaxContractionVelocity() * 
-                                muscle.getOptimalFiberLength())
+        with checkout_model(pathModel) as model:
+            model_muscles = model.getMuscles()
+            for i in range(len(muscles)):
+               muscle = model_muscles.get(muscles[i])
+               mtParameters[0,i] = muscle.getMaxIsometricForce()
+               mtParameters[1,i] = muscle.getOptimalFiberLength()
+               mtParameters[2,i] = muscle.getTendonSlackLength()
+               mtParameters[3,i] = muscle.getPennationAngleAtOptimalFiberLength()
+               mtParameters[4,i] = (muscle.getMaxContractionVelocity() * 
+                                    muscle.getOptimalFiberLength())
         if pathMTParameters != 0:
            np.save(os.path.join(pathMTParameters, 
                                 '{}_mtParameters_{}.npy'.format(
@@ -70,9 +70,9 @@ def get_mtu_length_and_moment_arm(pathModel, data, coordinates_table,
     numpy_to_storage(labels, c_data, motionPath, datatype='IK')
     
     # Model.
+    from utilsModelCache import get_model
     opensim.Logger.setLevelString('error')
-    model = opensim.Model(pathModel)
-    model.initSystem()
+    model = get_model(pathModel)
     
     # Create time-series table with coordinate values. 
     table = opensim.TimeSeriesTable(motionPath)
@@ -237,15 +237,16 @@ def getPolynomialData(loadPolynomialData, pathModelFolder, modelName='',
                 dM[-rest:, :, :] = output_last[1]
             # Put data in dict.
             # Muscles as ordered in model.
+            from utilsModelCache import checkout_model
             opensim.Logger.setLevelString('error')
-            model = opensim.Model(pathModel)  
             allMuscles = []
-            forceSet = model.getForceSet()
-            for i in range(forceSet.getSize()):        
-                c_force_elt = forceSet.get(i)  
-                if (c_force_elt.getConcreteClassName() == 
-                    "Millard2012EquilibriumMuscle"):
-                    allMuscles.append(c_force_elt.getName())    
+            with checkout_model(pathModel) as model:
+                forceSet = model.getForceSet()
+                for i in range(forceSet.getSize()):        
+                    c_force_elt = forceSet.get(i)  
+                    if (c_force_elt.getConcreteClassName() == 
+                        "Millard2012EquilibriumMuscle"):
+                        allMuscles.append(c_force_elt.getName())    
             data4PolynomialFitting = {}
             data4PolynomialFitting['mtu_lengths'] = lMT
             data4PolynomialFitting['mtu_moment_arms'] = dM
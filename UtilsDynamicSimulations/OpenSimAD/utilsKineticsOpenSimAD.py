@@ -24,6 +24,8 @@ import pandas as pd
 import utils
 import opensim
 
+from utilsModelCache import get_model
+
 class kineticsOpenSimAD:
     
     def __init__(self, data_dir, session_id, trial_name, case=None, 
@@ -87,8 +89,7 @@ class kineticsOpenSimAD:
         if not os.path.exists(modelPath):
             raise Exception('Model path: ' + modelPath + ' does not exist.')
 
-        self.model = opensim.Model(modelPath)
-        self.model.initSystem()
+        self.model = get_model(modelPath)
         
         # Coordinates.
         self.coordinateSet = self.model.getCoordinateSet()
@@ -40,6 +40,7 @@ from utils import (storage_to_numpy, storage_to_dataframe,
 from utilsProcessing import (segment_squats, segment_STS, adjust_muscle_wrapping,
                              generate_model_with_contacts)
 from settingsOpenSimAD import get_setup
+from utilsModelCache import get_model
 
 # %% Filter numpy array.
 def filterNumpyArray(array, time, cutoff_frequency=6, order=4):
@@ -573,8 +574,7 @@ def generateExternalFunction(
     
     # %% Generate external Function (.cpp file)
     opensim.Logger.setLevelString('error')
-    model = opensim.Model(pathModel)
-    model.initSystem()
+    model = get_model(pathModel)
     bodySet = model.getBodySet()
     jointSet = model.get_JointSet()
     nJoints = jointSet.getSize()
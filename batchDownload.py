@@ -18,7 +18,7 @@
     limitations under the License.
 '''
 
-from utils import download_session
+from utils import download_sessions
 import os
 
 # List of sessions you'd like to download. They go to the Data folder in the 
@@ -38,6 +38,10 @@ sessionList = ['7272a71a-e70a-4794-a253-39e11cb7542c',
 # base directory for downloads. Specify None if you want to go to os.path.join(os.getcwd(),'Data')
 downloadPath = os.path.join(os.getcwd(),'Data')
 
-for session_id in sessionList:
-    # If only interested in marker and OpenSim data, downladVideos=False will be faster
-    download_session(session_id,sessionBasePath=downloadPath,downloadVideos=True)
\ No newline at end of file
+# Sessions are downloaded concurrently. Progress is saved in 
+# downloadPath/downloadLedger.json, such that re-running this script skips the
+# sessions that were already downloaded. Sessions of subjects can also be
+# downloaded by passing subject_ids.
+# If only interested in marker and OpenSim data, downladVideos=False will be faster
+download_sessions(session_ids=sessionList, sessionBasePath=downloadPath,
+                  nSessions=4, downloadVideos=True)
@@ -0,0 +1,246 @@
+'''
+    ---------------------------------------------------------------------------
+    OpenCap processing: benchmarkStorageIO.py
+    ---------------------------------------------------------------------------
+
+    Copyright 2022 Stanford University and the Authors
+
+    Author(s): Antoine Falisse, Scott Uhlrich
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not
+    use this file except in compliance with the License. You may obtain a copy
+    of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+    This script compares the storage file reader and writer against the
+    implementations they replace (np.genfromtxt, and cell-by-cell writes), on
+    the bundled Moco .mot files, on a long synthetic file obtained by tiling
+    them, and on a 10k-row, 100-column array. It also compares TRCFile.write
+    against the frame-by-frame writer it replaces on a 5-minute, 60 Hz,
+    64-marker file. Outputs are checked to be identical, and written storage
+    files are read back with storage_to_numpy. Finally, it compares the
+    backends of read_storage on the bundled OpenSimPipeline and Moco motion
+    files (the opensim backend is skipped if opensim is not installed), and
+    checks that storage_to_numpy and read_storage return identical, writable
+    arrays on a cold and a warm array cache (read-only with mmap=True).
+'''
+
+import os
+import time
+import tempfile
+import numpy as np
+
+from utils import storage_to_numpy, numpy_to_storage, read_storage
+from utilsTRC import TRCFile
+
+baseDir = os.path.dirname(os.path.abspath(__file__))
+motionFiles = [
+    os.path.join(baseDir, 'Moco', 'exampleSquat', 'squats1_videoAndMocap.mot'),
+    os.path.join(baseDir, 'Moco', 'exampleWalking', 'walking1_videoAndMocap.mot')]
+pipelineMotionFiles = [
+    os.path.join(baseDir, 'OpenSimPipeline', 'InverseDynamics',
+                 'DefaultPosition_rajagopal.mot'),
+    os.path.join(baseDir, 'OpenSimPipeline', 'MuscleAnalysis',
+                 'DummyMotion.mot')]
+nRepeats = 3
+nTiles = 50
+
+# %% Reference implementation (np.genfromtxt).
+def storage_to_numpy_genfromtxt(storage_file):
+    with open(storage_file, 'r') as f:
+        for i, line in enumerate(f):
+            if line.count('endheader') != 0:
+                skip_header = i + 1
+                break
+    return np.genfromtxt(storage_file, names=True, skip_header=skip_header)
+
+# Reference implementation (cell-by-cell writes), IK header only.
+def numpy_to_storage_loop(labels, data, storage_file):
+    f = open(storage_file, 'w')
+    f.write('Coordinates\n')
+    f.write('version=1\n')
+    f.write('nRows=%d\n' %data.shape[0])
+    f.write('nColumns=%d\n' %data.shape[1])
+    f.write('inDegrees=yes\n\n')
+    f.write('Units are S.I. units (second, meters, Newtons, ...)\n')
+    f.write("If the header above contains a line with 'inDegrees', this indicates whether rotational values are in degrees (yes) or radians (no).\n\n")
+    f.write('endheader \n')
+    for i in range(len(labels)):
+        f.write('%s\t' %labels[i])
+    f.write('\n')
+    for i in range(data.shape[0]):
+        for j in range(data.shape[1]):
+            f.write('%20.8f\t' %data[i, j])
+        f.write('\n')
+    f.close()
+
+# Reference implementation of TRCFile.write (frame by frame, marker by marker),
+# on the structured array used by previous versions of TRCFile.
+def write_trc_loop(trc, data, fpath):
+    f = open(fpath, 'w')
+    f.write('PathFileType  4\t(X/Y/Z) %s\n' % os.path.split(fpath)[0])
+    f.write('DataRate\tCameraRate\tNumFrames\tNumMarkers\t'
+            'Units\tOrigDataRate\tOrigDataStartFrame\tOrigNumFrames\n')
+    f.write('%.1f\t%.1f\t%i\t%i\t%s\t%.1f\t%i\t%i\n' % (
+        trc.data_rate, trc.camera_rate, trc.num_frames,
+        trc.num_markers, trc.units, trc.orig_data_rate,
+        trc.orig_data_start_frame, trc.orig_num_frames))
+    f.write('Frame#\tTime\t')
+    for imark in range(trc.num_markers):
+        f.write('%s\t\t\t' % trc.marker_names[imark])
+    f.write('\n')
+    f.write('\t\t')
+    for imark in np.arange(trc.num_markers) + 1:
+        f.write('X%i\tY%s\tZ%s\t' % (imark, imark, imark))
+    f.write('\n')
+    f.write('\n')
+    for iframe in range(trc.num_frames):
+        f.write('%i' % (iframe + 1))
+        f.write('\t%.7f' % trc.time[iframe])
+        for mark in trc.marker_names:
+            idxs = [mark + '_tx', mark + '_ty', mark + '_tz']
+            f.write('\t%.7f\t%.7f\t%.7f' % tuple(
+                data[coln][iframe] for coln in idxs))
+        f.write('\n')
+    f.close()
+
+def best_time(fn, *args):
+    times = []
+    for _ in range(nRepeats):
+        start = time.perf_counter()
+        out = fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), out
+
+def tile_storage_file(storage_file, nTiles, outputFile):
+    # Long file with the header of storage_file and its data repeated.
+    with open(storage_file, 'r') as f:
+        lines = f.readlines()
+    idx = [i for i, line in enumerate(lines) if 'endheader' in line][0] + 2
+    with open(outputFile, 'w') as f:
+        f.writelines(lines[:idx])
+        for _ in range(nTiles):
+            f.writelines(lines[idx:])
+
+# %% Reading.
+def benchmark_read(storage_file):
+    t_ref, ref = best_time(storage_to_numpy_genfromtxt, storage_file)
+    t_new, new = best_time(storage_to_numpy, storage_file)
+    assert ref.dtype == new.dtype
+    assert all(np.array_equal(ref[n], new[n], equal_nan=True)
+               for n in ref.dtype.names)
+    print('read  {:<40s} {:>7d} rows  genfromtxt {:8.1f} ms  '
+          'storage_to_numpy {:8.1f} ms  x{:.1f}'.format(
+              os.path.basename(storage_file), ref.shape[0], 1000*t_ref,
+              1000*t_new, t_ref/t_new))
+
+# %% Writing.
+def benchmark_write(labels, data, name, tmpDir):
+    refFile = os.path.join(tmpDir, 'ref.mot')
+    newFile = os.path.join(tmpDir, 'new.mot')
+    t_ref, _ = best_time(numpy_to_storage_loop, labels, data, refFile)
+    t_new, _ = best_time(numpy_to_storage, labels, data, newFile, 'IK')
+    with open(refFile, 'rb') as f_ref, open(newFile, 'rb') as f_new:
+        assert f_ref.read() == f_new.read(), 'Outputs differ'
+    # Round trip, up to the 8 decimals written.
+    data_read, labels_read = storage_to_numpy(newFile, structured=False)
+    assert labels_read == list(labels)
+    assert np.allclose(data_read, data, rtol=0, atol=5e-9)
+    print('write {:<40s} {:>7d} rows  loop       {:8.1f} ms  '
+          'numpy_to_storage {:8.1f} ms  x{:.1f}'.format(
+              name, data.shape[0], 1000*t_ref, 1000*t_new, t_ref/t_new))
+
+def benchmark_write_trc(nFrames, nMarkers, tmpDir):
+    np.random.seed(0)
+    trc = TRCFile(data_rate=60.0, camera_rate=60.0, num_frames=nFrames,
+                  num_markers=0, units='m', orig_data_rate=60.0,
+                  orig_data_start_frame=1, orig_num_frames=nFrames,
+                  time=np.arange(nFrames) / 60.0)
+    for imark in range(nMarkers):
+        x, y, z = np.random.randn(3, nFrames)
+        trc.add_marker('marker{}'.format(imark), x, y, z)
+    data = trc.data
+    refFile = os.path.join(tmpDir, 'ref.trc')
+    newFile = os.path.join(tmpDir, 'new.trc')
+    t_ref, _ = best_time(write_trc_loop, trc, data, refFile)
+    t_new, _ = best_time(trc.write, newFile)
+    with open(refFile, 'rb') as f_ref, open(newFile, 'rb') as f_new:
+        assert f_ref.read() == f_new.read(), 'Outputs differ'
+    print('write {:<40s} {:>7d} rows  loop       {:8.1f} ms  '
+          'TRCFile.write    {:8.1f} ms  x{:.1f}'.format(
+              '{} markers .trc'.format(nMarkers), nFrames, 1000*t_ref, 
+              1000*t_new, t_ref/t_new))
+
+# %% Reader backends.
+def benchmark_backends(storage_file, cacheDir):
+    from utilsCache import set_array_cache_dir
+    
+    backends = ['numpy', 'cached']
+    try:
+        import opensim
+        backends.append('opensim')
+    except ImportError:
+        pass
+    
+    set_array_cache_dir(cacheDir)
+    try:
+        # Populate the cache first: the cached time is the time of a hit.
+        read_storage(storage_file, backend='cached')
+        ref, refLabels = read_storage(storage_file, backend='numpy')
+        times = []
+        for backend in backends:
+            t, (data, labels) = best_time(read_storage, storage_file, backend)
+            assert labels == refLabels
+            assert np.allclose(data, ref, rtol=0, atol=1e-8, equal_nan=True)
+            times.append('{} {:8.2f} ms'.format(backend, 1000*t))
+    finally:
+        set_array_cache_dir(None)
+    print('read_storage {:<33s} {:>7d} rows  {}'.format(
+        os.path.basename(storage_file), ref.shape[0], '  '.join(times)))
+
+def check_cache_copies(storage_file, cacheDir):
+    from utilsCache import set_array_cache_dir
+    set_array_cache_dir(cacheDir)
+    try:
+        readers = [
+            lambda **kw: storage_to_numpy(storage_file, **kw),
+            lambda **kw: storage_to_numpy(storage_file, structured=False,
+                                          **kw)[0],
+            lambda **kw: read_storage(storage_file, backend='cached',
+                                      **kw)[0]]
+        for reader in readers:
+            cold, warm = reader(), reader()
+            for data in [cold, warm]:
+                assert data.flags.writeable
+                data[0] = data[0]
+            assert cold.dtype == warm.dtype and cold.tobytes() == warm.tobytes()
+            assert not reader(mmap=True).flags.writeable
+    finally:
+        set_array_cache_dir(None)
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmpDir:
+        longFile = os.path.join(tmpDir, 'squats1_tiled.mot')
+        tile_storage_file(motionFiles[0], nTiles, longFile)
+        for storage_file in motionFiles + [longFile]:
+            benchmark_read(storage_file)
+        for storage_file in motionFiles + [longFile]:
+            data, labels = storage_to_numpy(storage_file, structured=False)
+            benchmark_write(labels, data, os.path.basename(storage_file),
+                            tmpDir)
+        np.random.seed(0)
+        data = np.random.randn(10000, 100)
+        data[:, 0] = np.arange(10000) / 100
+        labels = ['time'] + ['column_{}'.format(i) for i in range(1, 100)]
+        benchmark_write(labels, data, 'random_10000x100', tmpDir)
+        benchmark_write_trc(5*60*60, 64, tmpDir)
+        for storage_file in pipelineMotionFiles + motionFiles + [longFile]:
+            benchmark_backends(storage_file, os.path.join(tmpDir, 'cache'))
+        for storage_file in motionFiles:
+            check_cache_copies(storage_file, os.path.join(tmpDir, 'cache2'))
+        print('Cold and warm cache reads are identical and writable.')
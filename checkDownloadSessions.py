@@ -0,0 +1,146 @@
+'''
+    ---------------------------------------------------------------------------
+    OpenCap processing: checkDownloadSessions.py
+    ---------------------------------------------------------------------------
+
+    Copyright 2022 Stanford University and the Authors
+
+    Author(s): Antoine Falisse, Scott Uhlrich
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not
+    use this file except in compliance with the License. You may obtain a copy
+    of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+    This script checks download_sessions against a local stand-in of the
+    OpenCap API, served by http.server: two sessions (calibration, neutral,
+    and one dynamic trial each) with their session and trial json, and media
+    served from the same server. The IK results of the dynamic trial of the
+    second session are missing (404). The first run must record the first
+    session as 'done' and the second as 'partial', listing the failed trial;
+    once the media is available, a second run must skip the first session and
+    complete the second. No token or network access is needed.
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utilsAPI import APIClient, set_client
+from utils import download_sessions
+
+# %% Stand-in API.
+sessions = {}
+trials = {}
+missingMedia = set()
+
+def add_session(session_id):
+    trialNames = ['calibration', 'neutral', 'walking']
+    sessionTrials = []
+    for k, name in enumerate(trialNames):
+        trial_id = '{}-{}'.format(session_id, name)
+        sessionTrials.append({'id': trial_id, 'name': name,
+                              'created_at': '2022-01-01T00:00:0{}'.format(k)})
+        trials[trial_id] = {'id': trial_id, 'name': name, 'status': 'done',
+                            'videos': [], 'meta': None, 'results': []}
+    sessions[session_id] = {'id': session_id, 'trials': sessionTrials,
+                            'meta': {'neutral_trial': None,
+                                     'sessionWithCalibration': None}}
+
+    # Calibration.
+    calibration = trials['{}-calibration'.format(session_id)]
+    calibration['meta'] = {'calibration': {'Cam0': 0}}
+    calibration['results'] = [
+        {'tag': 'camera_mapping', 'device_id': 'all',
+         'media': media_url(session_id, 'mapping.pickle')},
+        {'tag': 'calibration_parameters_options', 'device_id': 'Cam0_soln0',
+         'media': media_url(session_id, 'calib_Cam0.pickle')},
+        {'tag': 'calibration-img', 'device_id': 'Cam0',
+         'media': media_url(session_id, 'calib_img_Cam0.jpg')}]
+
+    # Neutral: metadata and model. The model has no geometries to download.
+    trials['{}-neutral'.format(session_id)]['results'] = [
+        {'tag': 'session_metadata', 'device_id': 'all',
+         'media': media_url(session_id, 'metadata.yaml')},
+        {'tag': 'opensim_model', 'device_id': 'all',
+         'media': media_url(session_id, 'model-Standin_scaled.osim')}]
+
+    # Dynamic trials: marker and IK data.
+    for name in trialNames[1:]:
+        trials['{}-{}'.format(session_id, name)]['results'] += [
+            {'tag': 'marker_data', 'device_id': 'all',
+             'media': media_url(session_id, name + '.trc')},
+            {'tag': 'ik_results', 'device_id': 'all',
+             'media': media_url(session_id, name + '.mot')}]
+
+def media_url(session_id, name):
+    return '{}media/{}/{}?signature=0'.format(apiUrl, session_id, name)
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split('?')[0].strip('/').split('/')
+        if path[0] == 'sessions' and path[1] in sessions:
+            self.send_body(json.dumps(sessions[path[1]]).encode())
+        elif path[0] == 'trials' and path[1] in trials:
+            self.send_body(json.dumps(trials[path[1]]).encode())
+        elif path[0] == 'media' and '/'.join(path[1:]) not in missingMedia:
+            self.send_body('/'.join(path[1:]).encode())
+        else:
+            self.send_error(404)
+
+    def send_body(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+apiUrl = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+threading.Thread(target=server.serve_forever, daemon=True).start()
+set_client(APIClient(api_url=apiUrl, token='stand-in', max_retries=0))
+
+add_session('session1')
+add_session('session2')
+missingMedia.add('session2/walking.mot')
+
+# %% Check.
+dataDir = tempfile.mkdtemp()
+try:
+    ledgerPath = os.path.join(dataDir, 'downloadLedger.json')
+    results = download_sessions(['session1', 'session2'],
+                                sessionBasePath=dataDir, downloadVideos=False)
+    assert results['session1']['status'] == 'done', results['session1']
+    assert results['session2']['status'] == 'partial', results['session2']
+    assert results['session2']['failed_trials'] == ['session2-walking']
+    with open(ledgerPath, 'r') as f:
+        ledger = json.load(f)
+    assert ledger['session2']['status'] == 'partial'
+
+    # Restart once the media is available.
+    missingMedia.clear()
+    results = download_sessions(['session1', 'session2'],
+                                sessionBasePath=dataDir, downloadVideos=False)
+    assert list(results) == ['session2'], results
+    assert results['session2']['status'] == 'done', results['session2']
+    with open(ledgerPath, 'r') as f:
+        ledger = json.load(f)
+    assert all(entry['status'] == 'done' for entry in ledger.values())
+    assert os.path.exists(os.path.join(
+        dataDir, 'OpenCapData_session2', 'OpenSimData', 'Kinematics',
+        'walking.mot'))
+    print('\ndownload_sessions: ledger checks passed.')
+finally:
+    server.shutdown()
+    shutil.rmtree(dataDir)
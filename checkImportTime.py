@@ -0,0 +1,79 @@
+'''
+    ---------------------------------------------------------------------------
+    OpenCap processing: checkImportTime.py
+    ---------------------------------------------------------------------------
+
+    Copyright 2022 Stanford University and the Authors
+
+    Author(s): Antoine Falisse, Scott Uhlrich
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not
+    use this file except in compliance with the License. You may obtain a copy
+    of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+    This script checks the import time of utils, utilsKinematics, and
+    gait_analysis. Each module is imported in a fresh interpreter with stdin
+    closed, such that an interactive login at import fails rather than
+    blocks. The import must take less than IMPORT_TIME_BUDGET seconds (best of
+    nRepeats), must not import opensim nor matplotlib, and must not resolve
+    the API token.
+'''
+
+import os
+import sys
+import json
+import subprocess
+
+IMPORT_TIME_BUDGET = {'utils': 1.0, 'utilsKinematics': 3.0,
+                      'gait_analysis': 3.0}
+LAZY_MODULES = ['opensim', 'matplotlib']
+nRepeats = 3
+
+baseDir = os.path.dirname(os.path.abspath(__file__))
+importCode = '''
+import sys, time, json
+sys.path[:0] = {paths!r}
+startTime = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - startTime
+import utilsAPI
+client = getattr(utilsAPI, 'API_CLIENT', None)
+print(json.dumps({{
+    'seconds': elapsed,
+    'lazy': [m for m in {lazy!r} if m in sys.modules],
+    'token': client is not None and client.token is not None}}))
+'''
+
+def time_import(module):
+    code = importCode.format(
+        paths=[baseDir, os.path.join(baseDir, 'ActivityAnalyses')],
+        module=module, lazy=LAZY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=baseDir,
+                            stdin=subprocess.DEVNULL, capture_output=True,
+                            text=True, timeout=120)
+    if output.returncode != 0:
+        raise Exception('Importing {} failed:\n{}'.format(module,
+                                                          output.stderr))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+failures = []
+for module, budget in IMPORT_TIME_BUDGET.items():
+    results = [time_import(module) for i in range(nRepeats)]
+    seconds = min(result['seconds'] for result in results)
+    print('{:16s} {:6.3f} s (budget {:.1f} s)'.format(module, seconds, budget))
+    if seconds > budget:
+        failures.append('{} takes {:.3f} s to import.'.format(module, seconds))
+    if results[0]['lazy']:
+        failures.append('{} imports {}.'.format(
+            module, ', '.join(results[0]['lazy'])))
+    if results[0]['token']:
+        failures.append('{} resolves the API token.'.format(module))
+
+assert not failures, '\n'.join(failures)
+print('\nImport checks passed.')
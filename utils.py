@@ -19,35 +19,286 @@
 '''
 
 import os
-import requests
-import urllib.request
 import shutil
 import numpy as np
-import pandas as pd
 import yaml
 import pickle
 import glob
 import zipfile
-import platform
-import opensim
+import io
+import uuid
+import time
+import threading
+import contextvars
+import contextlib
+import hashlib
+import json
+import string
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
-from utilsAPI import get_api_url
-from utilsAuthentication import get_token
-import matplotlib.pyplot as plt
-from scipy.signal import gaussian
+from decouple import config
+from utilsAPI import get_api_url, get_client
+from utilsCache import load_cached, get_array_cache_dir, SIDECAR
 
+# opensim, pandas, matplotlib and scipy are imported in the functions that
+# need them, such that importing utils is fast. Similarly, the API token is
+# only resolved (from the .env file, or by logging in) when the API is first
+# used, see APIClient.get_token.
 
 API_URL = get_api_url()
-API_TOKEN = get_token()
 
-def download_file(url, file_name):
-    with urllib.request.urlopen(url) as response, open(file_name, 'wb') as out_file:
-        shutil.copyfileobj(response, out_file)
+# API_TOKEN is resolved on first access.
+def __getattr__(name):
+    if name == 'API_TOKEN':
+        return get_client().get_token()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
+
+# %% Download engine.
+# Maximum number of simultaneous downloads from a single host, shared by all
+# threads of the process.
+MAX_DOWNLOADS_PER_HOST = 8
+# Size (bytes) of the chunks streamed to disk.
+DOWNLOAD_CHUNK_SIZE = 1024*1024
+_hostSemaphores = {}
+_hostSemaphoresLock = threading.Lock()
+
+def set_max_downloads_per_host(maxDownloads, host=None):
+    # Set the limit for a given host (eg, 'api.opencap.ai'), or the default
+    # limit for all hosts if host is None.
+    global MAX_DOWNLOADS_PER_HOST
+    with _hostSemaphoresLock:
+        if host is None:
+            MAX_DOWNLOADS_PER_HOST = maxDownloads
+            _hostSemaphores.clear()
+        else:
+            _hostSemaphores[host] = threading.BoundedSemaphore(maxDownloads)
+
+def _get_host_semaphore(url):
+    host = urlparse(url).netloc
+    with _hostSemaphoresLock:
+        if host not in _hostSemaphores:
+            _hostSemaphores[host] = threading.BoundedSemaphore(
+                MAX_DOWNLOADS_PER_HOST)
+        return _hostSemaphores[host]
+
+# Aggregate statistics of the downloads of a run (eg, download_session). The
+# active DownloadStats is stored in a context variable, which is propagated to
+# worker threads by submit_in_context.
+class DownloadStats:
+    
+    def __init__(self):
+        self.nBytes = 0
+        self.nFiles = 0
+        self.startTime = time.time()
+        self._lock = threading.Lock()
+        
+    def add(self, nBytes):
+        with self._lock:
+            self.nBytes += nBytes
+            self.nFiles += 1
+            
+    def summary(self):
+        elapsed = time.time() - self.startTime
+        return {'files': self.nFiles, 'bytes': self.nBytes,
+                'seconds': elapsed,
+                'MBps': self.nBytes / 1e6 / elapsed if elapsed > 0 else 0}
+    
+    def report(self):
+        summary = self.summary()
+        print('Downloaded {} files ({:.1f} MB) in {:.1f} s ({:.2f} MB/s).'.format(
+            summary['files'], summary['bytes'] / 1e6, summary['seconds'],
+            summary['MBps']))
+        
+_downloadStats = contextvars.ContextVar('downloadStats', default=None)
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    # Run fn in the executor with a copy of the current context, such that
+    # the worker contributes to the statistics of the calling run.
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
+
+# Files are first downloaded to <file_name>.part and renamed once complete and
+# verified, such that an interrupted download never leaves a partial file
+# behind. The next call resumes the .part file with an HTTP Range request; the
+# ETag of the first response is saved in <file_name>.part.etag such that the
+# server restarts from scratch (If-Range) if the file changed in between.
+def download_file(url, file_name, chunk_size=None, resume=True):
+    
+    if chunk_size is None:
+        chunk_size = DOWNLOAD_CHUNK_SIZE
+    partPath = file_name + '.part'
+    etagPath = partPath + '.etag'
+    
+    # Request the missing bytes only if a partial download exists.
+    # Media urls are pre-signed, so no API token is sent.
+    headers = {'Accept-Encoding': 'identity'}
+    nBytesPart = 0
+    if resume and os.path.exists(partPath):
+        nBytesPart = os.path.getsize(partPath)
+    if nBytesPart > 0:
+        headers['Range'] = 'bytes={}-'.format(nBytesPart)
+        if os.path.exists(etagPath):
+            with open(etagPath, 'r') as f:
+                headers['If-Range'] = f.read()
+        
+    nBytes = 0
+    with _get_host_semaphore(url):
+        with get_client().get(url, authenticate=False, stream=True,
+                              headers=headers) as response:
+            if response.status_code == 416:
+                # The partial file already has all the bytes (or is invalid,
+                # in which case the verification below fails).
+                expectedSize = _get_total_size(response)
+                mode = None
+            else:
+                response.raise_for_status()
+                if response.status_code == 206:
+                    mode = 'ab'
+                    expectedSize = _get_total_size(response)
+                else:
+                    # Full content, eg the server does not support ranges or
+                    # the file changed since the partial download.
+                    mode = 'wb'
+                    expectedSize = response.headers.get('Content-Length')
+                    if expectedSize is not None:
+                        expectedSize = int(expectedSize)
+            etag = response.headers.get('ETag')
+            etagIsMd5 = _is_etag_md5(response)
+            if mode is not None:
+                if etag is not None and mode == 'wb':
+                    with open(etagPath, 'w') as f:
+                        f.write(etag)
+                with open(partPath, mode) as out_file:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        out_file.write(chunk)
+                        nBytes += len(chunk)
+    
+    # Verify the download, then move it in place.
+    _verify_download(partPath, expectedSize, etag if etagIsMd5 else None)
+    os.replace(partPath, file_name)
+    if os.path.exists(etagPath):
+        os.remove(etagPath)
+    zipWriter = _zipWriter.get()
+    if zipWriter is not None:
+        zipWriter.add(file_name)
+    
+    stats = _downloadStats.get()
+    if stats is not None:
+        stats.add(nBytes)
+        
+    return nBytes
+
+def _get_total_size(response):
+    # Content-Range: bytes 100-199/200 or bytes */200
+    contentRange = response.headers.get('Content-Range', '')
+    total = contentRange[contentRange.rfind('/')+1:]
+    if total.isdigit():
+        return int(total)
+    return None
+
+def _is_etag_md5(response):
+    # The ETag of S3 objects encrypted with SSE-KMS or SSE-C is not the md5 of
+    # the content, only their size can be verified.
+    encryption = response.headers.get('x-amz-server-side-encryption', '')
+    return (encryption.lower() != 'aws:kms' and 
+            'x-amz-server-side-encryption-customer-algorithm' not in 
+            response.headers)
+
+def _verify_download(partPath, expectedSize, etag):
+    size = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+    if expectedSize is not None and size != expectedSize:
+        # A partial file that is larger than the remote file cannot be
+        # resumed, start over next time.
+        if size > expectedSize:
+            os.remove(partPath)
+        raise Exception('Incomplete download of {}: {} of {} bytes.'.format(
+            partPath, size, expectedSize))
+    # For single-part uploads, the ETag of S3 objects is the md5 of the
+    # content. Multipart ETags contain a '-' and cannot be verified. etag is
+    # None if it is not an md5 (see _is_etag_md5).
+    if etag is not None:
+        etag = etag.strip('"')
+        if len(etag) != 32 or not all(c in string.hexdigits for c in etag):
+            return
+        md5 = hashlib.md5()
+        with open(partPath, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                md5.update(chunk)
+        if md5.hexdigest() != etag.lower():
+            os.remove(partPath)
+            raise Exception('Corrupted download of {}: checksum mismatch.'.format(
+                partPath))
+
+def download_files(urlsAndPaths, nWorkers=None):
+    # Download a list of (url, file_name) concurrently.
+    if nWorkers is None:
+        nWorkers = MAX_DOWNLOADS_PER_HOST
+    if len(urlsAndPaths) <= 1:
+        for url, file_name in urlsAndPaths:
+            download_file(url, file_name)
+        return
+    with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+        futures = [submit_in_context(executor, download_file, url, file_name)
+                   for url, file_name in urlsAndPaths]
+        for future in futures:
+            future.result()
+
+# %% Request-scoped cache of session and trial json.
+# Within a run (eg, download_session), the same session and trial json are
+# needed by several functions. When a cache is active, each session and trial
+# is fetched only once; the cached json must therefore not be modified.
+class APICache:
+    
+    def __init__(self):
+        self._data = {}
+        self._keyLocks = {}
+        self._lock = threading.Lock()
+        
+    def get_or_fetch(self, key, fetch):
+        with self._lock:
+            if key not in self._keyLocks:
+                self._keyLocks[key] = threading.Lock()
+            keyLock = self._keyLocks[key]
+        # Concurrent requests for the same key wait for the first fetch.
+        with keyLock:
+            if key not in self._data:
+                self._data[key] = fetch()
+            return self._data[key]
+        
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+        
+_apiCache = contextvars.ContextVar('apiCache', default=None)
+
+@contextlib.contextmanager
+def cached_api_responses():
+    # Nested runs share the cache of the outermost run.
+    if _apiCache.get() is not None:
+        yield _apiCache.get()
+        return
+    cache = APICache()
+    cacheToken = _apiCache.set(cache)
+    try:
+        yield cache
+    finally:
+        _apiCache.reset(cacheToken)
+        
+def _get_cached(key, fetch):
+    cache = _apiCache.get()
+    if cache is None:
+        return fetch()
+    return cache.get_or_fetch(key, fetch)
 
 def get_session_json(session_id):
-    resp = requests.get(
-        API_URL + "sessions/{}/".format(session_id),
-        headers = {"Authorization": "Token {}".format(API_TOKEN)})
+    return _get_cached(('session', session_id),
+                       lambda: _fetch_session_json(session_id))
+
+def _fetch_session_json(session_id):
+    resp = get_client().get("sessions/{}/".format(session_id))
     
     if resp.status_code == 500:
         raise Exception('No server response. Likely not a valid session id.')
@@ -65,41 +316,36 @@ def get_session_json(session_id):
     
 # Returns a list of all sessions of the user.
 def get_user_sessions():
-    sessions = requests.get(
-        API_URL + "sessions/valid/", 
-        headers = {"Authorization": "Token {}".format(API_TOKEN)}).json()
+    sessions = get_client().get("sessions/valid/").json()
     
     return sessions
 
 # Returns a list of all sessions of the user.
 # TODO: this also contains public sessions of other users.
-def get_user_sessions_all(user_token=API_TOKEN):
-    sessions = requests.get(
-        API_URL + "sessions/", 
-        headers = {"Authorization": "Token {}".format(user_token)}).json()
+def get_user_sessions_all(user_token=None):
+    sessions = get_client().get("sessions/", token=user_token).json()
     
     return sessions
 
 # Returns a list of all subjects of the user.
-def get_user_subjects(user_token=API_TOKEN):
-    subjects = requests.get(
-            API_URL + "subjects/", 
-            headers = {"Authorization": "Token {}".format(user_token)}).json()
+def get_user_subjects(user_token=None):
+    subjects = get_client().get("subjects/", token=user_token).json()
     
     return subjects
 
 # Returns a list of all sessions of a subject.
-def get_subject_sessions(subject_id, user_token=API_TOKEN):
-    sessions = requests.get(
-        API_URL + "subjects/{}/".format(subject_id),
-        headers = {"Authorization": "Token {}".format(user_token)}).json()['sessions']
+def get_subject_sessions(subject_id, user_token=None):
+    sessions = get_client().get(
+        "subjects/{}/".format(subject_id), token=user_token).json()['sessions']
     
     return sessions
 
 def get_trial_json(trial_id):
-    trialJson = requests.get(
-        API_URL + "trials/{}/".format(trial_id),
-        headers = {"Authorization": "Token {}".format(API_TOKEN)}).json()
+    return _get_cached(('trial', trial_id),
+                       lambda: _fetch_trial_json(trial_id))
+
+def _fetch_trial_json(trial_id):
+    trialJson = get_client().get("trials/{}/".format(trial_id)).json()
     
     return trialJson
 
@@ -173,7 +419,16 @@ def get_main_settings(session_folder,trial_name):
     return main_settings
 
         
-def get_model_name_from_metadata(sessionFolder,appendText='_scaled'):
+def get_model_name_from_metadata(sessionFolder,appendText='_scaled',
+                                 session=None):
+    # session: reader of the session files (see utilsSessionStore), to read
+    # the metadata from the session store rather than from sessionFolder.
+    if session is not None:
+        if session.exists('sessionMetadata.yaml'):
+            metadata = session.read_metadata()
+            return metadata['openSimModel'] + appendText + '.osim'
+        raise Exception('Session metadata not found, could not identify OpenSim model.')
+    
     metadataPath = os.path.join(sessionFolder,'sessionMetadata.yaml')
     
     if os.path.exists(metadataPath):
@@ -218,45 +473,151 @@ def get_motion_data(trial_id, session_path):
             download_file(settingsURL, settingsPath)
         
         
-def get_geometries(session_path, modelName='LaiUhlrich2022_scaled'):
+# %% Geometries.
+# The geometry files (.vtp) are the same for all sessions using a given model.
+# They are downloaded once into a persistent, content-addressed store 
+# (objects/<sha256>.vtp), with an index per model type mapping the names of the
+# geometries to their content. Sessions hardlink (or symlink, or copy as a
+# fallback) the geometries from the store. The store is in ~/.opencap/Geometry
+# by default, set GEOMETRY_CACHE_DIR (environment or .env file) to change it.
+GEOMETRY_URL = 'https://mc-opencap-public.s3.us-west-2.amazonaws.com/geometries_vtp/{}/{}.vtp'
+GEOMETRY_NAMES = {
+    'LaiArnold': [
+        'capitate_lvs','capitate_rvs','hamate_lvs','hamate_rvs',
+        'hat_jaw','hat_ribs_scap','hat_skull','hat_spine','humerus_lv',
+        'humerus_rv','index_distal_lvs','index_distal_rvs',
+        'index_medial_lvs', 'index_medial_rvs','index_proximal_lvs',
+        'index_proximal_rvs','little_distal_lvs','little_distal_rvs',
+        'little_medial_lvs','little_medial_rvs','little_proximal_lvs',
+        'little_proximal_rvs','lunate_lvs','lunate_rvs','l_bofoot',
+        'l_femur','l_fibula','l_foot','l_patella','l_pelvis','l_talus',
+        'l_tibia','metacarpal1_lvs','metacarpal1_rvs',
+        'metacarpal2_lvs','metacarpal2_rvs','metacarpal3_lvs',
+        'metacarpal3_rvs','metacarpal4_lvs','metacarpal4_rvs',
+        'metacarpal5_lvs','metacarpal5_rvs','middle_distal_lvs',
+        'middle_distal_rvs','middle_medial_lvs','middle_medial_rvs',
+        'middle_proximal_lvs','middle_proximal_rvs','pisiform_lvs',
+        'pisiform_rvs','radius_lv','radius_rv','ring_distal_lvs',
+        'ring_distal_rvs','ring_medial_lvs','ring_medial_rvs',
+        'ring_proximal_lvs','ring_proximal_rvs','r_bofoot','r_femur',
+        'r_fibula','r_foot','r_patella','r_pelvis','r_talus','r_tibia',
+        'sacrum','scaphoid_lvs','scaphoid_rvs','thumb_distal_lvs',
+        'thumb_distal_rvs','thumb_proximal_lvs','thumb_proximal_rvs',
+        'trapezium_lvs','trapezium_rvs','trapezoid_lvs','trapezoid_rvs',
+        'triquetrum_lvs','triquetrum_rvs','ulna_lv','ulna_rv'
+    ]}
+_geometryCacheLock = threading.Lock()
+
+def get_geometry_cache_dir():
+    return config('GEOMETRY_CACHE_DIR', default=os.path.join(
+        os.path.expanduser('~'), '.opencap', 'Geometry'))
+
+def get_geometry_model_type(modelName):
+    if 'Lai' in modelName:
+        return 'LaiArnold'
+    else:
+        raise ValueError("Geometries not available for this model")
+
+def _load_geometry_index(cacheDir, modelType):
+    indexPath = os.path.join(cacheDir, modelType + '.json')
+    if not os.path.exists(indexPath):
+        return {}
+    with open(indexPath, 'r') as f:
+        return json.load(f)
+
+def _add_to_geometry_cache(cacheDir, modelType, vtpName):
+    # Download to a temporary file and move it to its content address. The
+    # store may be shared by several processes: temporary names are unique
+    # per process and thread.
+    objectsDir = os.path.join(cacheDir, 'objects')
+    os.makedirs(objectsDir, exist_ok=True)
+    tempPath = os.path.join(objectsDir, '{}_{}_{}_{}.vtp.tmp'.format(
+        modelType, vtpName, os.getpid(), threading.get_ident()))
+    download_file(GEOMETRY_URL.format(modelType, vtpName), tempPath)
+    sha256 = hashlib.sha256()
+    with open(tempPath, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    os.replace(tempPath, os.path.join(objectsDir, digest + '.vtp'))
+    
+    return digest
+
+def populate_geometry_cache(modelType, cacheDir=None, nWorkers=8):
+    # Download the geometries that are not in the store yet. Returns the
+    # index (name: sha256) and a dict with the geometries that failed.
+    if cacheDir is None:
+        cacheDir = get_geometry_cache_dir()
+    os.makedirs(cacheDir, exist_ok=True)
+    
+    with _geometryCacheLock:
+        index = _load_geometry_index(cacheDir, modelType)
+        missing = [vtpName for vtpName in GEOMETRY_NAMES[modelType] if 
+                   vtpName not in index or not os.path.exists(os.path.join(
+                       cacheDir, 'objects', index[vtpName] + '.vtp'))]
+        if not missing:
+            return index, {}
         
-    geometryFolder = os.path.join(session_path, 'OpenSimData', 'Model', 'Geometry')
+        failures = {}
+        added = {}
+        with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+            futures = {vtpName: submit_in_context(
+                executor, _add_to_geometry_cache, cacheDir, modelType, vtpName)
+                for vtpName in missing}
+            for vtpName, future in futures.items():
+                try:
+                    added[vtpName] = future.result()
+                except Exception as e:
+                    failures[vtpName] = str(e)
+        
+        # Merge with the index on disk, which another process may have
+        # updated in the meantime, right before replacing it.
+        index = _load_geometry_index(cacheDir, modelType)
+        index.update(added)
+        indexPath = os.path.join(cacheDir, modelType + '.json')
+        tempPath = indexPath + '.tmp{}_{}'.format(os.getpid(), 
+                                                 threading.get_ident())
+        with open(tempPath, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tempPath, indexPath)
+        
+    return index, failures
+
+def _link_file(src, dst):
     try:
-        # Download.
-        os.makedirs(geometryFolder, exist_ok=True)
-        if 'Lai' in modelName:
-            modelType = 'LaiArnold'
-            vtpNames = [
-                'capitate_lvs','capitate_rvs','hamate_lvs','hamate_rvs',
-                'hat_jaw','hat_ribs_scap','hat_skull','hat_spine','humerus_lv',
-                'humerus_rv','index_distal_lvs','index_distal_rvs',
-                'index_medial_lvs', 'index_medial_rvs','index_proximal_lvs',
-                'index_proximal_rvs','little_distal_lvs','little_distal_rvs',
-                'little_medial_lvs','little_medial_rvs','little_proximal_lvs',
-                'little_proximal_rvs','lunate_lvs','lunate_rvs','l_bofoot',
-                'l_femur','l_fibula','l_foot','l_patella','l_pelvis','l_talus',
-                'l_tibia','metacarpal1_lvs','metacarpal1_rvs',
-                'metacarpal2_lvs','metacarpal2_rvs','metacarpal3_lvs',
-                'metacarpal3_rvs','metacarpal4_lvs','metacarpal4_rvs',
-                'metacarpal5_lvs','metacarpal5_rvs','middle_distal_lvs',
-                'middle_distal_rvs','middle_medial_lvs','middle_medial_rvs',
-                'middle_proximal_lvs','middle_proximal_rvs','pisiform_lvs',
-                'pisiform_rvs','radius_lv','radius_rv','ring_distal_lvs',
-                'ring_distal_rvs','ring_medial_lvs','ring_medial_rvs',
-                'ring_proximal_lvs','ring_proximal_rvs','r_bofoot','r_femur',
-                'r_fibula','r_foot','r_patella','r_pelvis','r_talus','r_tibia',
-                'sacrum','scaphoid_lvs','scaphoid_rvs','thumb_distal_lvs',
-                'thumb_distal_rvs','thumb_proximal_lvs','thumb_proximal_rvs',
-                'trapezium_lvs','trapezium_rvs','trapezoid_lvs','trapezoid_rvs',
-                'triquetrum_lvs','triquetrum_rvs','ulna_lv','ulna_rv']
-        else:
-            raise ValueError("Geometries not available for this model")                
-        for vtpName in vtpNames:
-            url = 'https://mc-opencap-public.s3.us-west-2.amazonaws.com/geometries_vtp/{}/{}.vtp'.format(modelType, vtpName)
-            filename = os.path.join(geometryFolder, '{}.vtp'.format(vtpName))                
-            download_file(url, filename)
-    except:
-        pass
+        os.link(src, dst)
+    except OSError:
+        try:
+            os.symlink(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+def get_geometries(session_path, modelName='LaiUhlrich2022_scaled',
+                   cacheDir=None):
+    
+    # Returns a dict with the geometries that could not be added to the
+    # session (name: error).
+    modelType = get_geometry_model_type(modelName)
+    if cacheDir is None:
+        cacheDir = get_geometry_cache_dir()
+    index, failures = populate_geometry_cache(modelType, cacheDir=cacheDir)
+    
+    geometryFolder = os.path.join(session_path, 'OpenSimData', 'Model', 'Geometry')
+    os.makedirs(geometryFolder, exist_ok=True)
+    for vtpName, digest in index.items():
+        filename = os.path.join(geometryFolder, '{}.vtp'.format(vtpName))
+        if not os.path.exists(filename):
+            try:
+                _link_file(os.path.join(cacheDir, 'objects', digest + '.vtp'),
+                           filename)
+            except Exception as e:
+                failures[vtpName] = str(e)
+            
+    if failures:
+        print('Warning: {} geometries could not be downloaded: {}.'.format(
+            len(failures), ', '.join(sorted(failures.keys()))))
+        
+    return failures
     
 def import_metadata(filePath):
     myYamlFile = open(filePath)
@@ -264,7 +625,151 @@ def import_metadata(filePath):
     
     return parsedYamlFile
     
-def download_kinematics(session_id, folder=None, trialNames=None):
+# %% Session manifest.
+# A manifest (opencapManifest.json) in the session folder records, for each
+# trial, the results (id, tag, device, media url without signature, 
+# timestamps) and videos that were downloaded. With sync=True, 
+# download_session and download_kinematics compare the manifest with the
+# server, delete the local files of trials that were reprocessed or deleted,
+# and skip the trials that did not change. When the session json embeds the
+# results and videos of the trials, a sync costs a single API call.
+MANIFEST_FILENAME = 'opencapManifest.json'
+
+def _strip_url(url):
+    if url and '?' in url:
+        return url[:url.find('?')]
+    return url
+
+def get_trial_manifest_entry(trial):
+    results = [{'id': r.get('id'), 'tag': r.get('tag'),
+                'device_id': r.get('device_id'),
+                'media': _strip_url(r.get('media')),
+                'updated_at': r.get('updated_at', r.get('created_at'))}
+               for r in trial.get('results') or []]
+    videos = [{'id': v.get('id'), 'device_id': v.get('device_id'),
+               'video': _strip_url(v.get('video')),
+               'updated_at': v.get('updated_at', v.get('created_at'))}
+              for v in trial.get('videos') or []]
+    
+    return {'name': trial['name'], 'status': trial.get('status'),
+            'results': sorted(results, key=str),
+            'videos': sorted(videos, key=str)}
+
+def load_session_manifest(session_path):
+    manifestPath = os.path.join(session_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifestPath):
+        return {'trials': {}}
+    with open(manifestPath, 'r') as f:
+        return json.load(f)
+    
+def write_session_manifest(session_path, manifest):
+    manifest['synced_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    manifestPath = os.path.join(session_path, MANIFEST_FILENAME)
+    with open(manifestPath + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifestPath + '.tmp', manifestPath)
+    
+def _get_full_trial_json(trial):
+    # Use the results and videos embedded in the session json if available,
+    # and make them available to the other functions of the run.
+    if 'results' in trial and 'videos' in trial:
+        cache = _apiCache.get()
+        if cache is not None:
+            cache.set(('trial', trial['id']), trial)
+        return trial
+    return get_trial_json(trial['id'])
+
+def _get_result_files(session_path, trial_name):
+    files = [
+        os.path.join(session_path, 'MarkerData', trial_name + '.trc'),
+        os.path.join(session_path, 'OpenSimData', 'Kinematics', 
+                     trial_name + '.mot'),
+        os.path.join(session_path, 'MarkerData', 'Settings', 
+                     'settings_' + trial_name + '.yaml')]
+    files += glob.glob(os.path.join(session_path, 'Videos', '*', 'InputMedia',
+                                    trial_name, trial_name + '_sync.*'))
+    if trial_name == 'neutral':
+        files.append(os.path.join(session_path, 'sessionMetadata.yaml'))
+        files += glob.glob(os.path.join(session_path, 'OpenSimData', 'Model',
+                                        '*.osim'))
+    return files
+
+def _get_video_files(session_path, trial_name):
+    return glob.glob(os.path.join(session_path, 'Videos', '*', 'InputMedia',
+                                  trial_name, trial_name + '.mov'))
+
+def _remove_files(files):
+    removed = [file for file in files if os.path.exists(file)]
+    for file in removed:
+        os.remove(file)
+    return removed
+
+def _prepare_sync(session_path, sessionJson, trial_ids, checkVideos=True):
+    # Returns the manifest, the new manifest entries of trial_ids, and the
+    # trials that did not change since the last sync.
+    manifest = load_session_manifest(session_path)
+    sessionTrials = {t['id']: t for t in sessionJson['trials']}
+    removedFiles = []
+    
+    # Trials deleted from the server.
+    for trial_id in list(manifest['trials'].keys()):
+        if trial_id not in sessionTrials:
+            oldEntry = manifest['trials'].pop(trial_id)
+            removedFiles += _remove_files(
+                _get_result_files(session_path, oldEntry['name']) + 
+                _get_video_files(session_path, oldEntry['name']))
+    
+    # Trials changed on the server, eg reprocessed.
+    entries = {}
+    unchanged = set()
+    for trial_id in trial_ids:
+        entry = get_trial_manifest_entry(
+            _get_full_trial_json(sessionTrials[trial_id]))
+        entries[trial_id] = entry
+        oldEntry = manifest['trials'].get(trial_id)
+        if not checkVideos:
+            # Videos are not downloaded, keep their previous state.
+            entry['videos'] = oldEntry.get('videos') if oldEntry else None
+        if oldEntry is None:
+            continue
+        renamed = oldEntry['name'] != entry['name']
+        resultsChanged = renamed or oldEntry['results'] != entry['results']
+        videosChanged = checkVideos and (
+            renamed or oldEntry.get('videos') != entry['videos'])
+        if resultsChanged:
+            removedFiles += _remove_files(
+                _get_result_files(session_path, oldEntry['name']))
+        if videosChanged:
+            removedFiles += _remove_files(
+                _get_video_files(session_path, oldEntry['name']))
+        if not resultsChanged and not videosChanged:
+            unchanged.add(trial_id)
+                
+    if removedFiles:
+        print('Removed {} outdated files.'.format(len(removedFiles)))
+            
+    return manifest, entries, unchanged
+    
+def download_kinematics(session_id, folder=None, trialNames=None, sync=False,
+                        sessionStore=False):
+    
+    # Each session and trial json is fetched once.
+    with cached_api_responses():
+        out = _download_kinematics(session_id, folder=folder,
+                                   trialNames=trialNames, sync=sync)
+    
+    # Consolidate the session in a single store file (see utilsSessionStore).
+    # An existing store is rewritten, such that it includes the files that
+    # were downloaded.
+    from utilsSessionStore import write_session_store, has_session_store
+    if folder is None:
+        folder = os.getcwd()
+    if sessionStore or has_session_store(folder):
+        write_session_store(folder)
+        
+    return out
+    
+def _download_kinematics(session_id, folder=None, trialNames=None, sync=False):
     
     # Login to access opencap data from server. 
     
@@ -273,19 +778,32 @@ def download_kinematics(session_id, folder=None, trialNames=None):
         folder = os.getcwd()    
     os.makedirs(folder, exist_ok=True)
     
-    # Model and metadata.
-    neutral_id = get_neutral_trial_id(session_id)
-    get_motion_data(neutral_id, folder)
-    modelName = get_model_and_metadata(session_id, folder)
-    # Remove extension from modelName
-    modelName = modelName.replace('.osim','')
-    
     # Session trial names.
     sessionJson = get_session_json(session_id)
     sessionTrialNames = [t['name'] for t in sessionJson['trials']]
     if trialNames != None:
         [print(t + ' not in session trial names.') 
          for t in trialNames if t not in sessionTrialNames]
+    trial_ids = [t['id'] for t in sessionJson['trials'] if 
+                 trialNames is None or t['name'] in trialNames]
+    
+    # Compare with the manifest of the previous download. The neutral trial
+    # may belong to another session and is then not synced.
+    neutral_id = get_neutral_trial_id(session_id)
+    unchanged = set()
+    if sync:
+        sessionTrialIds = [t['id'] for t in sessionJson['trials']]
+        manifest, entries, unchanged = _prepare_sync(
+            folder, sessionJson, [i for i in dict.fromkeys(
+                [neutral_id] + trial_ids) if i in sessionTrialIds],
+            checkVideos=False)
+    
+    # Model and metadata.
+    if neutral_id not in unchanged:
+        get_motion_data(neutral_id, folder)
+    modelName = get_model_and_metadata(session_id, folder)
+    # Remove extension from modelName
+    modelName = modelName.replace('.osim','')
     
     # Motion data.
     loadedTrialNames = []
@@ -293,20 +811,33 @@ def download_kinematics(session_id, folder=None, trialNames=None):
         if trialNames is not None and trialDict['name'] not in trialNames:
             continue        
         trial_id = trialDict['id']
-        get_motion_data(trial_id,folder)
+        if trial_id not in unchanged:
+            get_motion_data(trial_id,folder)
         loadedTrialNames.append(trialDict['name'])
         
+    if sync:
+        manifest['trials'].update(entries)
+        write_session_manifest(folder, manifest)
+        
     # Remove 'calibration' and 'neutral' from loadedTrialNames.    
     loadedTrialNames = [i for i in loadedTrialNames if i!='neutral' and i!='calibration']
         
     # Geometries.
-    get_geometries(folder, modelName=modelName)
+    try:
+        get_geometries(folder, modelName=modelName)
+    except Exception as e:
+        print('Warning: geometries not downloaded: {}'.format(e))
         
     return loadedTrialNames, modelName
 
 # Download pertinent trial data.
 def download_trial(trial_id, folder, session_id=None):
     
+    with cached_api_responses():
+        return _download_trial(trial_id, folder, session_id=session_id)
+    
+def _download_trial(trial_id, folder, session_id=None):
+    
     trial = get_trial_json(trial_id)
     if session_id is None:
         session_id = trial['session_id']
@@ -331,55 +862,163 @@ def get_trial_id(session_id,trial_name):
     return trial_id[0]
 
 # %%  Storage file to numpy array.
-def storage_to_numpy(storage_file, excess_header_entries=0):
+def storage_to_numpy(storage_file, excess_header_entries=0, columns=None,
+                     structured=True, mmap=False):
     """Returns the data from a storage file in a numpy format. Skips all lines
     up to and including the line that says 'endheader'.
     Parameters
     ----------
     storage_file : str
         Path to an OpenSim Storage (.sto) file.
-    Returns
-    -------
-    data : np.ndarray (or numpy structure array or something?)
-        Contains all columns from the storage file, indexable by column name.
     excess_header_entries : int, optional
         If the header row has more names in it than there are data columns.
         We'll ignore this many header row entries from the end of the header
         row. This argument allows for a hacky fix to an issue that arises from
         Static Optimization '.sto' outputs.
+    columns : list of str, optional
+        Names of the columns to load; all columns are loaded by default.
+    structured : bool, optional
+        If True (default), returns a structured array indexable by column
+        name. If False, returns a 2D float array and the list of labels.
+    mmap : bool, optional
+        If True and the array cache is enabled, returns a read-only view of
+        the memory-mapped cache entry rather than a copy.
+    Returns
+    -------
+    data : np.ndarray (or numpy structure array or something?)
+        Contains all columns from the storage file, indexable by column name.
+        If structured is False, (data, labels) with data a 2D float array.
     Examples
     --------
     Columns from the storage file can be obtained as follows:
         >>> data = storage2numpy('<filename>')
         >>> data['ground_force_vy']
     """
-    # What's the line number of the line containing 'endheader'?
-    f = open(storage_file, 'r')
-
-    header_line = False
-    for i, line in enumerate(f):
-        if header_line:
-            column_names = line.split()
-            break
-        if line.count('endheader') != 0:
-            line_number_of_line_containing_endheader = i + 1
-            header_line = True
-    f.close()
+    # The parsed table is cached if the array cache is enabled (utilsCache).
+    data, metadata = load_cached(
+        storage_file, 'storage{}'.format(excess_header_entries),
+        lambda path: _read_storage_table(path, excess_header_entries))
+    names = metadata['names']
+    
+    if columns is not None:
+        missing = [c for c in columns if c not in names]
+        if missing:
+            raise KeyError('Columns {} not in {}'.format(missing, storage_file))
+        data = data[:, [names.index(c) for c in columns]]
+        names = list(columns)
+    if not mmap and not data.flags.writeable:
+        data = np.array(data)
+    
+    if not structured:
+        return data, names
+    # Reinterpret the 2D array as a structured array without copying.
+    dtype = np.dtype([(name, np.float64) for name in names])
+    return data.view(dtype).reshape(-1)
 
-    # With this information, go get the data.
-    if excess_header_entries == 0:
-        names = True
-        skip_header = line_number_of_line_containing_endheader
-    else:
-        names = column_names[:-excess_header_entries]
-        skip_header = line_number_of_line_containing_endheader + 1
-    data = np.genfromtxt(storage_file, names=names,
-            skip_header=skip_header)
+def _read_storage_header(storage_file, excess_header_entries=0):
+    # Returns the number of lines before the column names, the column names
+    # as sanitized by np.genfromtxt(names=True), and the column labels as in
+    # the file.
+    
+    # Parse the header once: find the line containing 'endheader', the column
+    # names that follow it, and the first data line.
+    with open(storage_file, 'r') as f:
+        skip_header = None
+        for i, line in enumerate(f):
+            if line.count('endheader') != 0:
+                skip_header = i + 1
+                break
+        if skip_header is None:
+            raise ValueError('No endheader line in {}'.format(storage_file))
+        header_line = f.readline()
+        first_data_line = f.readline()
+    column_names = header_line.split()
+    if excess_header_entries != 0:
+        column_names = column_names[:-excess_header_entries]
+        
+    # Sanitize the names exactly like np.genfromtxt(names=True) did, by 
+    # parsing the header and first data line only.
+    sample = np.genfromtxt(io.StringIO(' '.join(column_names) + '\n' +
+                                       first_data_line), names=True)
+    
+    return skip_header, list(sample.dtype.names), column_names
+
+def _read_storage_in_degrees(storage_file):
+    # Returns True if the header of a storage file has inDegrees=yes, ie the
+    # rotational values are in degrees; as OpenSim, radians are assumed
+    # otherwise.
+    with open(storage_file, 'r') as f:
+        for line in f:
+            if line.count('endheader') != 0:
+                break
+            key, _, value = line.partition('=')
+            if key.strip() == 'inDegrees':
+                return value.strip().lower() == 'yes'
+    return False
+
+def _read_storage_table(storage_file, excess_header_entries=0):
+    # Returns the data of a storage file as a 2D float array, and a dict with
+    # the sanitized column names ('names') and column labels ('labels').
+    skip_header, names, labels = _read_storage_header(storage_file,
+                                                      excess_header_entries)
+    
+    # The numeric block is parsed by the C parser of np.loadtxt (numpy>=1.23).
+    data = np.loadtxt(storage_file, dtype=np.float64, skiprows=skip_header + 1,
+                      ndmin=2)
+    
+    return data, {'names': names, 'labels': labels}
+
+# %%  Iterate over blocks of rows of a storage file.
+STORAGE_CHUNK_ROWS = 10000
 
-    return data
+def iter_storage_chunks(storage_file, chunk_size=STORAGE_CHUNK_ROWS, 
+                        columns=None, excess_header_entries=0):
+    """Yields the data of a storage file in blocks of chunk_size rows, such
+    that files that do not fit in memory can be processed.
+    Parameters
+    ----------
+    storage_file : str
+        Path to an OpenSim Storage (.sto) or motion (.mot) file.
+    chunk_size : int, optional
+        Number of rows per block (the last block may be shorter).
+    columns : list of str, optional
+        Names of the columns to load; all columns are loaded by default.
+    excess_header_entries : int, optional
+        See storage_to_numpy.
+    Yields
+    ------
+    data : np.ndarray
+        2D float array with chunk_size rows.
+    labels : list of str
+        Column labels of data.
+    """
+    skip_header, names, _ = _read_storage_header(storage_file,
+                                                 excess_header_entries)
+    if columns is None:
+        usecols = None
+    else:
+        missing = [c for c in columns if c not in names]
+        if missing:
+            raise KeyError('Columns {} not in {}'.format(missing, storage_file))
+        usecols = [names.index(c) for c in columns]
+        names = list(columns)
+    
+    with open(storage_file, 'r') as f:
+        for _ in range(skip_header + 1):
+            f.readline()
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            lines = [line for line in lines if line.strip()]
+            if lines:
+                yield np.loadtxt(lines, dtype=np.float64, usecols=usecols,
+                                 ndmin=2), names
 
 # %%  Storage file to dataframe.
 def storage_to_dataframe(storage_file, headers):
+    import pandas as pd
+    
     # Extract data
     data = storage_to_numpy(storage_file)
     out = pd.DataFrame(data=data['time'], columns=['time'])    
@@ -388,22 +1027,108 @@ def storage_to_dataframe(storage_file, headers):
     
     return out
 
-# %% Load storage and output as dataframe or numpy
-def load_storage(file_path,outputFormat='numpy'):
+# %% Unified storage reader.
+# Storage (.sto) and motion (.mot) files can be read with several backends,
+# which all return (data, labels), with data a 2D float array whose first
+# column is time, and labels the column labels as in the file:
+#   numpy: header parsed once, numeric block parsed by np.loadtxt's C parser.
+#   opensim: opensim.TimeSeriesTable.
+#   cached: numpy backend through the array cache (see utilsCache); the
+#       cache files are written next to the storage files if no cache
+#       directory is configured. read_storage returns a copy of the
+#       memory-mapped cache entry, unless mmap=True.
+# Other backends can be added with register_storage_reader.
+def _read_storage_numpy(storage_file):
+    data, metadata = _read_storage_table(storage_file)
+    return data, metadata['labels']
+
+def _read_time_series_table(file_path):
+    import opensim
+    
     table = opensim.TimeSeriesTable(file_path)    
     data = table.getMatrix().to_numpy()
     time = np.asarray(table.getIndependentColumn()).reshape(-1, 1)
     data = np.hstack((time,data))
     headers = ['time'] + list(table.getColumnLabels())
     
+    return data, headers
+
+def _read_storage_cached(storage_file):
+    data, metadata = load_cached(storage_file, 'storage0', _read_storage_table,
+                                 cacheDir=get_array_cache_dir() or SIDECAR)
+    return data, metadata['labels']
+
+STORAGE_READERS = {
+    'numpy': _read_storage_numpy,
+    'opensim': _read_time_series_table,
+    'cached': _read_storage_cached}
+
+def register_storage_reader(name, reader):
+    # reader(storage_file) returns (data, labels).
+    STORAGE_READERS[name] = reader
+    
+def get_default_storage_reader():
+    # Fastest backend: the cached one if the array cache is enabled.
+    return 'cached' if get_array_cache_dir() else 'numpy'
+
+def read_storage(storage_file, backend=None, columns=None, 
+                 outputFormat='numpy', mmap=False):
+    """Reads a storage (.sto) or motion (.mot) file.
+    Parameters
+    ----------
+    storage_file : str
+        Path to the file.
+    backend : str, optional
+        One of STORAGE_READERS; get_default_storage_reader() by default.
+    columns : list of str, optional
+        Labels of the columns to return; all columns by default.
+    outputFormat : str, optional
+        'numpy' or 'dataframe'.
+    mmap : bool, optional
+        If True, the cached backend returns a read-only view of the
+        memory-mapped cache entry rather than a copy.
+    Returns
+    -------
+    data, labels : np.ndarray, list of str
+        If outputFormat is 'numpy'.
+    df : pd.DataFrame
+        If outputFormat is 'dataframe'.
+    """
+    if backend is None:
+        backend = get_default_storage_reader()
+    if backend not in STORAGE_READERS:
+        raise ValueError('Unknown backend {}, available backends: {}'.format(
+            backend, list(STORAGE_READERS)))
+    data, labels = STORAGE_READERS[backend](storage_file)
+    
+    if columns is not None:
+        missing = [c for c in columns if c not in labels]
+        if missing:
+            raise KeyError('Columns {} not in {}'.format(missing, storage_file))
+        data = data[:, [labels.index(c) for c in columns]]
+        labels = list(columns)
+    if not mmap and not data.flags.writeable:
+        data = np.array(data)
+    
     if outputFormat == 'numpy':
-        return data,headers
+        return data, labels
     elif outputFormat == 'dataframe':
-        return pd.DataFrame(data, columns=headers)
+        import pandas as pd
+        return pd.DataFrame(data, columns=labels)
     else:
-        return None    
+        raise ValueError('Unknown outputFormat {}'.format(outputFormat))
+
+# %% Load storage and output as dataframe or numpy
+def load_storage(file_path,outputFormat='numpy',backend=None):
+    # See read_storage; returns None for an unknown outputFormat.
+    if outputFormat not in ['numpy', 'dataframe']:
+        return None
+    
+    return read_storage(file_path, backend=backend, outputFormat=outputFormat)
     
 # %%  Numpy array to storage file.
+STORAGE_WRITE_BLOCK_ROWS = 1024
+
 def numpy_to_storage(labels, data, storage_file, datatype=None):
     
     assert data.shape[1] == len(labels), "# labels doesn't match columns"
@@ -412,7 +1137,6 @@ def numpy_to_storage(labels, data, storage_file, datatype=None):
     f = open(storage_file, 'w')
     # Old style
     if datatype is None:
-        f = open(storage_file, 'w')
         f.write('name %s\n' %storage_file)
         f.write('datacolumns %d\n' %data.shape[1])
         f.write('datarows %d\n' %data.shape[0])
@@ -452,13 +1176,26 @@ def numpy_to_storage(labels, data, storage_file, datatype=None):
         f.write('%s\t' %labels[i])
     f.write('\n')
     
-    for i in range(data.shape[0]):
-        for j in range(data.shape[1]):
-            f.write('%20.8f\t' %data[i, j])
-        f.write('\n')
+    # Format blocks of rows at once rather than cell by cell; the output is
+    # identical.
+    rowFormat = '%20.8f\t' * data.shape[1] + '\n'
+    for i in range(0, data.shape[0], STORAGE_WRITE_BLOCK_ROWS):
+        block = data[i:i+STORAGE_WRITE_BLOCK_ROWS]
+        f.write((rowFormat * block.shape[0]) % tuple(block.ravel().tolist()))
         
     f.close()
 
+# One lock per camera mapping file (ie, per session folder).
+_cameraMappingLocks = {}
+_cameraMappingLocksLock = threading.Lock()
+
+def _get_camera_mapping_lock(mappingPath):
+    mappingPath = os.path.abspath(mappingPath)
+    with _cameraMappingLocksLock:
+        if mappingPath not in _cameraMappingLocks:
+            _cameraMappingLocks[mappingPath] = threading.Lock()
+        return _cameraMappingLocks[mappingPath]
+
 def download_videos_from_server(session_id,trial_id,
                              isCalibration=False, isStaticPose=False,
                              trial_name= None, session_path = None):
@@ -469,9 +1206,7 @@ def download_videos_from_server(session_id,trial_id,
     if not os.path.exists(session_path): 
         os.makedirs(session_path, exist_ok=True)
     
-    resp = requests.get("{}trials/{}/".format(API_URL,trial_id),
-                         headers = {"Authorization": "Token {}".format(API_TOKEN)})
-    trial = resp.json()
+    trial = get_trial_json(trial_id)
     if trial_name is None:
         trial_name = trial['name']
     trial_name = trial_name.replace(' ', '')
@@ -480,22 +1215,31 @@ def download_videos_from_server(session_id,trial_id,
 
     # The videos are not always organized in the same order. Here, we save
     # the order during the first trial processed in the session such that we
-    # can use the same order for the other trials.
-    if not os.path.exists(os.path.join(session_path, "Videos", 'mappingCamDevice.pickle')):
-        mappingCamDevice = {}
-        for k, video in enumerate(trial["videos"]):
-            os.makedirs(os.path.join(session_path, "Videos", "Cam{}".format(k), "InputMedia", trial_name), exist_ok=True)
-            video_path = os.path.join(session_path, "Videos", "Cam{}".format(k), "InputMedia", trial_name, trial_name + ".mov")
-            download_file(video["video"], video_path)                
-            mappingCamDevice[video["device_id"].replace('-', '').upper()] = k
-        with open(os.path.join(session_path, "Videos", 'mappingCamDevice.pickle'), 'wb') as handle:
-            pickle.dump(mappingCamDevice, handle)
-    else:
-        with open(os.path.join(session_path, "Videos", 'mappingCamDevice.pickle'), 'rb') as handle:
+    # can use the same order for the other trials. The trials of a session are
+    # downloaded concurrently, the mapping is created by a single trial (lock)
+    # and the others wait for it.
+    # The videos of the different cameras are downloaded concurrently.
+    videosToDownload = []
+    mappingPath = os.path.join(session_path, "Videos", 'mappingCamDevice.pickle')
+    os.makedirs(os.path.join(session_path, "Videos"), exist_ok=True)
+    with _get_camera_mapping_lock(mappingPath):
+        createMapping = not os.path.exists(mappingPath)
+        if createMapping:
+            mappingCamDevice = {}
+            for k, video in enumerate(trial["videos"]):
+                os.makedirs(os.path.join(session_path, "Videos", "Cam{}".format(k), "InputMedia", trial_name), exist_ok=True)
+                video_path = os.path.join(session_path, "Videos", "Cam{}".format(k), "InputMedia", trial_name, trial_name + ".mov")
+                videosToDownload.append((video["video"], video_path))
+                mappingCamDevice[video["device_id"].replace('-', '').upper()] = k
+            download_files(videosToDownload)
+            with open(mappingPath + '.tmp', 'wb') as handle:
+                pickle.dump(mappingCamDevice, handle)
+            os.replace(mappingPath + '.tmp', mappingPath)
+    if not createMapping:
+        with open(mappingPath, 'rb') as handle:
             mappingCamDevice = pickle.load(handle) 
             # ensure upper on deviceID
-            for dID in mappingCamDevice.keys():
-                mappingCamDevice[dID.upper()] = mappingCamDevice.pop(dID)
+            mappingCamDevice = {dID.upper(): k for dID, k in mappingCamDevice.items()}
         for video in trial["videos"]:            
             k = mappingCamDevice[video["device_id"].replace('-', '').upper()] 
             videoDir = os.path.join(session_path, "Videos", "Cam{}".format(k), "InputMedia", trial_name)
@@ -503,7 +1247,8 @@ def download_videos_from_server(session_id,trial_id,
             video_path = os.path.join(videoDir, trial_name + ".mov")
             if not os.path.exists(video_path):
                 if video['video'] :
-                    download_file(video["video"], video_path)
+                    videosToDownload.append((video["video"], video_path))
+        download_files(videosToDownload)
               
     return trial_name
    
@@ -511,9 +1256,7 @@ def download_videos_from_server(session_id,trial_id,
 def get_calibration(session_id,session_path):
     calibration_id = get_calibration_trial_id(session_id)
 
-    resp = requests.get("{}trials/{}/".format(API_URL,calibration_id),
-                         headers = {"Authorization": "Token {}".format(API_TOKEN)})
-    trial = resp.json()
+    trial = get_trial_json(calibration_id)
     calibResultTags = [res['tag'] for res in trial['results']]
    
     videoFolder = os.path.join(session_path,'Videos')
@@ -535,9 +1278,7 @@ def get_calibration(session_id,session_path):
 def download_and_switch_calibration(session_id,session_path,calibTrialID = None):
     if calibTrialID == None:
         calibTrialID = get_calibration_trial_id(session_id)
-    resp = requests.get("https://api.opencap.ai/trials/{}/".format(calibTrialID),
-                         headers = {"Authorization": "Token {}".format(API_TOKEN)})
-    trial = resp.json()
+    trial = get_trial_json(calibTrialID)
        
     calibURLs = {t['device_id']:t['media'] for t in trial['results'] if t['tag'] == 'calibration_parameters_options'}
     calibImgURLs = {t['device_id']:t['media'] for t in trial['results'] if t['tag'] == 'calibration-img'}
@@ -563,36 +1304,136 @@ def download_and_switch_calibration(session_id,session_path,calibTrialID = None)
                 download_file(calibImgURLs[cam + '_altSoln'],img_fileName)
                 
             
+# %% Uploads and deletions.
+# Multipart body streamed from disk: the form fields and the part headers are
+# built upfront, and the file is read in chunks while the request is sent,
+# such that large videos are never loaded in memory. requests uses __len__ to
+# set the Content-Length header.
+class MultipartFileStream:
+    
+    def __init__(self, fields, fileField, filePath):
+        self.boundary = uuid.uuid4().hex
+        head = b''
+        for name, value in fields.items():
+            if value is None:
+                continue
+            head += ('--{}\r\nContent-Disposition: form-data; name="{}"'
+                     '\r\n\r\n{}\r\n').format(
+                         self.boundary, name, value).encode('utf-8')
+        head += ('--{}\r\nContent-Disposition: form-data; name="{}"; '
+                 'filename="{}"\r\nContent-Type: application/octet-stream'
+                 '\r\n\r\n').format(
+                     self.boundary, fileField,
+                     os.path.basename(filePath)).encode('utf-8')
+        tail = '\r\n--{}--\r\n'.format(self.boundary).encode('utf-8')
+        self._length = len(head) + os.path.getsize(filePath) + len(tail)
+        self._parts = [io.BytesIO(head), open(filePath, 'rb'), io.BytesIO(tail)]
+        
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+        
+    def __len__(self):
+        return self._length
+        
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0).close()
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+    
+    def close(self):
+        for part in self._parts:
+            part.close()
+        self._parts = []
+        
+def _post_file_streamed(endpoint, fields, fileField, filePath):
+    body = MultipartFileStream(fields, fileField, filePath)
+    try:
+        response = get_client().post(
+            endpoint, data=body, headers={'Content-Type': body.content_type})
+    finally:
+        body.close()
+    return response
+            
 def post_file_to_trial(filePath,trial_id,tag,device_id):
-    files = {'media': open(filePath, 'rb')}
     data = {
         "trial": trial_id,
         "tag": tag,
         "device_id" : device_id
     }
 
-    requests.post("{}results/".format(API_URL), files=files, data=data,
-                         headers = {"Authorization": "Token {}".format(API_TOKEN)})
-    files["media"].close()
+    return _post_file_streamed("results/", data, 'media', filePath)
 
 def post_video_to_trial(filePath,trial_id,device_id,parameters):
-    files = {'video': open(filePath, 'rb')}
     data = {
         "trial": trial_id,
         "device_id" : device_id,
         "parameters": parameters
     }
 
-    requests.post("{}videos/".format(API_URL), files=files, data=data,
-                         headers = {"Authorization": "Token {}".format(API_TOKEN)})
-    files["video"].close()
+    return _post_file_streamed("videos/", data, 'video', filePath)
+
+# Run fn on each item with bounded concurrency. Each item gets a status
+# dict; a failing item is reported rather than raised, such that it does not
+# abort the rest of the batch.
+def _run_bulk(fn, items, nWorkers):
+    
+    def run_item(item):
+        status = {'item': item, 'ok': False, 'status_code': None, 
+                  'error': None}
+        try:
+            response = fn(item)
+            status['status_code'] = response.status_code
+            status['ok'] = response.ok
+            if not response.ok:
+                status['error'] = response.text[:500]
+        except Exception as e:
+            status['error'] = repr(e)
+        return status
+    
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(nWorkers, len(items)))) as executor:
+        futures = [submit_in_context(executor, run_item, item)
+                   for item in items]
+        return [future.result() for future in futures]
+
+def post_files_to_trial(items, nWorkers=4):
+    # items: list of dicts with keys filePath, trial_id, tag, device_id.
+    # Returns one status dict per item, in the same order.
+    return _run_bulk(
+        lambda item: post_file_to_trial(
+            item['filePath'], item['trial_id'], item['tag'], 
+            item.get('device_id')),
+        items, nWorkers)
+
+def post_videos_to_trial(items, nWorkers=4):
+    # items: list of dicts with keys filePath, trial_id, device_id, parameters.
+    # Returns one status dict per item, in the same order.
+    return _run_bulk(
+        lambda item: post_video_to_trial(
+            item['filePath'], item['trial_id'], item.get('device_id'),
+            item.get('parameters')),
+        items, nWorkers)
+
+def delete_result_ids(resultIds, nWorkers=4):
+    # Returns one status dict per result id, in the same order.
+    return _run_bulk(
+        lambda rNum: get_client().delete("results/{}/".format(rNum)),
+        list(resultIds), nWorkers)
 
 def delete_video_from_trial(video_id):
 
-    requests.delete("{}videos/{}/".format(API_URL, video_id),
-                        headers = {"Authorization": "Token {}".format(API_TOKEN)})
+    get_client().delete("videos/{}/".format(video_id))
     
-def delete_results(trial_id, tag=None, resultNum=None):
+def delete_results(trial_id, tag=None, resultNum=None, nWorkers=4):
     # Delete specific result number, or all results with a specific tag, or all results if tag==None
     if resultNum != None:
         resultNums = [resultNum]
@@ -604,9 +1445,12 @@ def delete_results(trial_id, tag=None, resultNum=None):
         trial = get_trial_json(trial_id)
         resultNums = [r['id'] for r in trial['results']]
 
-    for rNum in resultNums:
-        requests.delete(API_URL + "results/{}/".format(rNum),
-                        headers = {"Authorization": "Token {}".format(API_TOKEN)})
+    statuses = delete_result_ids(resultNums, nWorkers=nWorkers)
+    for status in statuses:
+        if not status['ok']:
+            print('Could not delete result {}: {}'.format(
+                status['item'], status['error'] or status['status_code']))
+    return statuses
         
 def set_trial_status(trial_id, status):
 
@@ -616,16 +1460,15 @@ def set_trial_status(trial_id, status):
     if status not in ['done', 'error', 'stopped', 'reprocess']:
         raise ValueError('Invalid status. Available statuses: done, error, stopped, reprocess')
 
-    requests.patch(API_URL+"trials/{}/".format(trial_id), data={'status': status},
-                     headers = {"Authorization": "Token {}".format(API_TOKEN)})
+    get_client().patch("trials/{}/".format(trial_id), data={'status': status})
     
 
 def get_syncd_videos(trial_id,session_path):
-    trial = requests.get("{}trials/{}/".format(API_URL,trial_id),
-                         headers = {"Authorization": "Token {}".format(API_TOKEN)}).json()
+    trial = get_trial_json(trial_id)
     trial_name = trial['name']
     
     if trial['results']:
+        videosToDownload = []
         for result in trial['results']:
             if result['tag'] == 'video-sync':
                 url = result['media']
@@ -635,13 +1478,135 @@ def get_syncd_videos(trial_id,session_path):
                     suff = suff[:lastIdx]
                 
                 syncVideoPath = os.path.join(session_path,'Videos',cam,'InputMedia',trial_name,trial_name + '_sync' + suff)
-                download_file(url,syncVideoPath)
+                videosToDownload.append((url, syncVideoPath))
+        download_files(videosToDownload)
+        
+        
+# %% Packaging.
+# Zip archive of a session folder. Files can be added while the session is 
+# being downloaded (download_file adds the files it completes to the active
+# writer), such that packaging is not on the critical path. Media that are
+# already compressed (eg, videos) are stored as is, the other files (eg, .trc,
+# .mot, .yaml) are deflated. The entries are written by a single writer
+# thread, fed by add, with the public zipfile API.
+ZIP_STORED_EXTENSIONS = ['.mov', '.mp4', '.avi', '.jpg', '.jpeg', '.png',
+                         '.zip', '.gz']
+# Files that are not packaged: partial downloads, temporary files, and the
+# session store (see utilsSessionStore), which duplicates the other files.
+ZIP_EXCLUDE_SUFFIXES = ['.part', '.part.etag']
+ZIP_EXCLUDE_NAMES = ['opencapSession.h5']
+
+class SessionZipWriter:
+    
+    def __init__(self, zipPath, session_path, compresslevel=6):
+        self.zipPath = zipPath
+        self.session_path = os.path.abspath(session_path)
+        # Archive names are relative to the parent of the session folder.
+        self.basePath = os.path.dirname(self.session_path)
+        self.compresslevel = compresslevel
+        self.zipf = zipfile.ZipFile(zipPath, 'w', zipfile.ZIP_DEFLATED)
+        # Single writer thread: ZipFile does not support concurrent writes.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+        self.added = set()
+        self._lock = threading.Lock()
+        
+    def add(self, filePath):
+        filePath = os.path.abspath(filePath)
+        if not filePath.startswith(self.session_path + os.sep):
+            return
+        arcname = os.path.relpath(filePath, self.basePath)
+        with self._lock:
+            if arcname in self.added:
+                return
+            self.added.add(arcname)
+        self.futures.append(self.executor.submit(
+            self._add_file, filePath, arcname))
         
+    def add_folder(self, folderPath=None):
+        # Add the files that were not added yet.
+        if folderPath is None:
+            folderPath = self.session_path
+        for root, dirs, files in os.walk(folderPath):
+            for file in files:
+                if (file in ZIP_EXCLUDE_NAMES or '.tmp' in file or 
+                        file.endswith(tuple(ZIP_EXCLUDE_SUFFIXES))):
+                    continue
+                self.add(os.path.join(root, file))
+                
+    def close(self):
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.executor.shutdown()
+            self.zipf.close()
         
+    def _add_file(self, filePath, arcname):
+        # Runs in the writer thread. Media are streamed from disk into the
+        # archive as is, the other files are deflated.
+        if os.path.splitext(filePath)[1].lower() in ZIP_STORED_EXTENSIONS:
+            self.zipf.write(filePath, arcname, 
+                            compress_type=zipfile.ZIP_STORED)
+        else:
+            self.zipf.write(filePath, arcname, 
+                            compress_type=zipfile.ZIP_DEFLATED,
+                            compresslevel=self.compresslevel)
+            
+_zipWriter = contextvars.ContextVar('zipWriter', default=None)
+
+# The synced videos are saved next to the input videos, so the latter are
+# downloaded first.
+def _download_trial_videos(session_id, trial_id, session_path, downloadVideos,
+                           isStaticPose=False):
+    if downloadVideos:
+        download_videos_from_server(session_id, trial_id,
+                                    isCalibration=False,
+                                    isStaticPose=isStaticPose,
+                                    session_path=session_path)
+    get_syncd_videos(trial_id, session_path)
+
+# Run fn and ignore failures, such that one missing trial or result does not
+# prevent the rest of the session from being downloaded. Returns whether fn
+# succeeded and its output.
+def _try_download(fn, *args, **kwargs):
+    try:
+        return True, fn(*args, **kwargs)
+    except:
+        return False, None
+
 def download_session(session_id, sessionBasePath= None,
-                     zipFolder=False,writeToDB=False, downloadVideos=True):
+                     zipFolder=False,writeToDB=False, downloadVideos=True,
+                     nWorkers=8, sync=False):
     print('\nDownloading {}'.format(session_id))
     
+    # Statistics of all files downloaded for this session.
+    stats = DownloadStats()
+    statsToken = _downloadStats.set(stats)
+    try:
+        # Each session and trial json is fetched once.
+        with cached_api_responses():
+            failedTrials = _download_session(session_id, sessionBasePath=sessionBasePath,
+                              zipFolder=zipFolder, writeToDB=writeToDB,
+                              downloadVideos=downloadVideos, nWorkers=nWorkers,
+                              sync=sync)
+    finally:
+        _downloadStats.reset(statsToken)
+    stats.report()
+    if failedTrials:
+        print('Warning: {} trial(s) not downloaded: {}'.format(
+            len(failedTrials), ', '.join(failedTrials)))
+    
+    # failed_trials lists the trials that were not (fully) downloaded.
+    summary = stats.summary()
+    summary['failed_trials'] = failedTrials
+    
+    return summary
+        
+def _download_session(session_id, sessionBasePath= None,
+                      zipFolder=False,writeToDB=False, downloadVideos=True,
+                      nWorkers=8, sync=False):
+    
     if sessionBasePath is None:
         sessionBasePath = os.path.join(os.getcwd(),'Data')
     
@@ -652,43 +1617,104 @@ def download_session(session_id, sessionBasePath= None,
     neutral_id = get_neutral_trial_id(session_id)
     dynamic_ids = [t['id'] for t in session['trials'] if (t['name'] != 'calibration' and t['name'] !='neutral')]  
     
-    # Calibration
+    # Zip: files are added to the archive as they are downloaded.
+    session_zip = '{}.zip'.format(session_path)
+    if os.path.isfile(session_zip):
+        os.remove(session_zip)  
+    if zipFolder:
+        os.makedirs(sessionBasePath, exist_ok=True)
+        zipWriter = SessionZipWriter(session_zip, session_path)
+        zipWriterToken = _zipWriter.set(zipWriter)
+    # The writer is closed, and the partial archive removed, if the download
+    # fails.
+    zipComplete = False
     try:
-        get_camera_mapping(session_id, session_path)
-        if downloadVideos:
-            download_videos_from_server(session_id,calib_id,
-                                 isCalibration=True,isStaticPose=False,
-                                 session_path = session_path) 
-
-        get_calibration(session_id,session_path)
-    except:
-        pass
+        failedTrials = _download_session_files(
+            session_id, session, session_path, calib_id, neutral_id,
+            dynamic_ids, downloadVideos=downloadVideos, nWorkers=nWorkers,
+            sync=sync)
+        
+        # Zip: add the files that were not downloaded in this run (eg, 
+        # README, geometries, files from previous runs).
+        if zipFolder:
+            zipWriter.add_folder()
+            zipComplete = True
+    finally:
+        if zipFolder:
+            _zipWriter.reset(zipWriterToken)
+            zipWriter.close()
+            if not zipComplete and os.path.isfile(session_zip):
+                os.remove(session_zip)
     
-    # Neutral
-    try:
-        modelName = get_model_and_metadata(session_id,session_path)
-        get_motion_data(neutral_id,session_path)
-        if downloadVideos:
-            download_videos_from_server(session_id,neutral_id,
-                             isCalibration=False,isStaticPose=True,
-                             session_path = session_path)
-
-        get_syncd_videos(neutral_id,session_path)
-    except:
-        pass
+    # Write zip as a result to last trial for now
+    if writeToDB:
+        post_file_to_trial(session_zip,dynamic_ids[-1],tag='session_zip',
+                           device_id='all')    
+        
+    return failedTrials
 
-    # Dynamic
-    for dynamic_id in dynamic_ids:
+def _download_session_files(session_id, session, session_path, calib_id,
+                            neutral_id, dynamic_ids, downloadVideos=True,
+                            nWorkers=8, sync=False):
+    
+    # Compare with the manifest of the previous download. The calibration
+    # trial may belong to another session and is then not synced.
+    unchanged = set()
+    succeeded = set()
+    if sync:
+        os.makedirs(session_path, exist_ok=True)
+        sessionTrialIds = [t['id'] for t in session['trials']]
+        manifest, entries, unchanged = _prepare_sync(
+            session_path, session, [i for i in [calib_id, neutral_id] + 
+            dynamic_ids if i in sessionTrialIds], checkVideos=downloadVideos)
+    
+    # Calibration
+    # This is done first since the camera mapping (mappingCamDevice.pickle) 
+    # is needed to organize the videos of the other trials.
+    if calib_id not in unchanged:
         try:
-            get_motion_data(dynamic_id,session_path)
+            get_camera_mapping(session_id, session_path)
             if downloadVideos:
-                download_videos_from_server(session_id,dynamic_id,
-                         isCalibration=False,isStaticPose=False,
-                         session_path = session_path)
-
-            get_syncd_videos(dynamic_id,session_path)
+                download_videos_from_server(session_id,calib_id,
+                                     isCalibration=True,isStaticPose=False,
+                                     session_path = session_path) 
+    
+            get_calibration(session_id,session_path)
+            succeeded.add(calib_id)
         except:
             pass
+    
+    # Neutral and dynamic
+    # The result files, videos, and synced videos of all trials are downloaded
+    # concurrently.
+    with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+        futureModelName = submit_in_context(
+            executor, _try_download, get_model_and_metadata, session_id,
+            session_path)
+        futures = {}
+        for trial_id in [neutral_id] + dynamic_ids:
+            if trial_id in unchanged:
+                continue
+            futures[trial_id] = [
+                submit_in_context(
+                    executor, _try_download, get_motion_data, trial_id,
+                    session_path),
+                submit_in_context(
+                    executor, _try_download, _download_trial_videos,
+                    session_id, trial_id, session_path, downloadVideos,
+                    isStaticPose=trial_id==neutral_id)]
+        for trial_id, trialFutures in futures.items():
+            if all([future.result()[0] for future in trialFutures]):
+                succeeded.add(trial_id)
+        modelName = futureModelName.result()[1]
+        
+    # Only record the trials that were fully downloaded, such that the others
+    # are retried with the next sync.
+    if sync:
+        manifest['trials'].update(
+            {trial_id: entry for trial_id, entry in entries.items() if 
+             trial_id in succeeded})
+        write_session_manifest(session_path, manifest)
         
     repoDir = os.path.dirname(os.path.abspath(__file__))
     
@@ -702,43 +1728,98 @@ def download_session(session_id, sessionBasePath= None,
         
     # Geometry
     try:
-        if 'Lai' in modelName:
-            modelType = 'LaiArnold'
-        else:
-            raise ValueError("Geometries not available for this model, please contact us")
-        if platform.system() == 'Windows':
-            geometryDir = os.path.join(repoDir, 'tmp', modelType, 'Geometry')
-        else:
-            geometryDir = "/tmp/{}/Geometry".format(modelType)
-        # If not in cache, download from s3.
-        if not os.path.exists(geometryDir):
-            os.makedirs(geometryDir, exist_ok=True)
-            get_geometries(session_path, modelName=modelName)
-        geometryDirEnd = os.path.join(session_path, 'OpenSimData', 'Model', 'Geometry')
-        shutil.copytree(geometryDir, geometryDirEnd)
-    except:
-        pass
+        get_geometries(session_path, modelName=modelName)
+    except Exception as e:
+        print('Warning: geometries not downloaded: {}'.format(e))
+    
+    # Trials that were neither downloaded nor unchanged since the last sync.
+    return [trial_id for trial_id in [calib_id, neutral_id] + dynamic_ids if 
+            trial_id not in succeeded and trial_id not in unchanged]
+    
+# %% Download a cohort of sessions.
+# Sessions are downloaded concurrently (nSessions at a time); the number of
+# simultaneous file downloads is further bounded per host for the whole
+# process (see set_max_downloads_per_host). Progress is saved in a ledger
+# (json) such that a restarted run skips the sessions that were completed.
+# Sessions with trials that failed are recorded as 'partial' and, like the
+# sessions that failed entirely ('error'), are downloaded again by the next
+# run.
+def download_sessions(session_ids=None, subject_ids=None,
+                      sessionBasePath=None, nSessions=4,
+                      nWorkersPerSession=4, ledgerPath=None, 
+                      downloadVideos=True, zipFolder=False):
     
-    # Zip   
-    def zipdir(path, ziph):
-        # ziph is zipfile handle
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                ziph.write(os.path.join(root, file), 
-                           os.path.relpath(os.path.join(root, file), 
-                                           os.path.join(path, '..')))    
-    session_zip = '{}.zip'.format(session_path)
-    if os.path.isfile(session_zip):
-        os.remove(session_zip)  
-    if zipFolder:
-        zipf = zipfile.ZipFile(session_zip, 'w', zipfile.ZIP_DEFLATED)
-        zipdir(session_path, zipf)
-        zipf.close()
-    
-    # Write zip as a result to last trial for now
-    if writeToDB:
-        post_file_to_trial(session_zip,dynamic_ids[-1],tag='session_zip',
-                           device_id='all')    
+    if sessionBasePath is None:
+        sessionBasePath = os.path.join(os.getcwd(),'Data')
+    os.makedirs(sessionBasePath, exist_ok=True)
+    if ledgerPath is None:
+        ledgerPath = os.path.join(sessionBasePath, 'downloadLedger.json')
+        
+    # Sessions to download.
+    session_ids = list(session_ids) if session_ids is not None else []
+    if subject_ids is not None:
+        for subject_id in subject_ids:
+            for session in get_subject_sessions(subject_id):
+                session_ids.append(
+                    session['id'] if isinstance(session, dict) else session)
+    session_ids = list(dict.fromkeys(session_ids))
+    
+    # Skip the sessions that were completed in a previous run.
+    ledger = {}
+    if os.path.exists(ledgerPath):
+        with open(ledgerPath, 'r') as f:
+            ledger = json.load(f)
+    sessionsToDownload = [s for s in session_ids if 
+                          ledger.get(s, {}).get('status') != 'done']
+    print('Downloading {} sessions ({} already downloaded).'.format(
+        len(sessionsToDownload), len(session_ids)-len(sessionsToDownload)))
+    
+    # Resolve the token (which may prompt for a login) once, before starting
+    # the download threads.
+    if sessionsToDownload:
+        get_client().get_token()
+    
+    ledgerLock = threading.Lock()
+    def update_ledger(session_id, entry):
+        with ledgerLock:
+            ledger[session_id] = entry
+            ledgerPathTemp = ledgerPath + '.tmp'
+            with open(ledgerPathTemp, 'w') as f:
+                json.dump(ledger, f, indent=2)
+            os.replace(ledgerPathTemp, ledgerPath)
+    
+    def download_one(session_id):
+        startTime = time.time()
+        try:
+            summary = download_session(
+                session_id, sessionBasePath=sessionBasePath,
+                zipFolder=zipFolder, downloadVideos=downloadVideos,
+                nWorkers=nWorkersPerSession)
+            entry = {'status': 'done', 'seconds': summary['seconds'],
+                     'bytes': summary['bytes'], 'files': summary['files']}
+            if summary['failed_trials']:
+                entry['status'] = 'partial'
+                entry['failed_trials'] = summary['failed_trials']
+        except Exception as e:
+            entry = {'status': 'error', 'error': str(e),
+                     'seconds': time.time() - startTime}
+        update_ledger(session_id, entry)
+        print('{}: {} in {:.1f} s ({:.1f} MB).'.format(
+            session_id, entry['status'], entry['seconds'], 
+            entry.get('bytes', 0) / 1e6))
+        
+        return entry
+    
+    # Each session runs in its own context (download statistics and cache).
+    results = {}
+    with ThreadPoolExecutor(max_workers=nSessions) as executor:
+        futures = {session_id: submit_in_context(executor, download_one,
+                                                 session_id)
+                   for session_id in sessionsToDownload}
+        for session_id, future in futures.items():
+            results[session_id] = future.result()
+            
+    return results
     
 def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False):
     """Calculates the cross correlation and lags without normalization.
@@ -753,6 +1834,9 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False):
     max_corr: Maximum correlation without normalization.
     lag: The lag in terms of the index.
     """
+    import matplotlib.pyplot as plt
+    from scipy.signal import gaussian
+    
     # Pad shorter signal with 0s
     if len(y1) > len(y2):
         temp = np.zeros(len(y1))
@@ -18,7 +18,11 @@
     limitations under the License.
 '''
 
+import threading
+import requests
 from decouple import config
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 def get_api_url():
     if 'API_URL' not in globals():
@@ -31,3 +35,100 @@ def get_api_url():
         API_URL= API_URL + '/'
 
     return API_URL
+
+# %% Shared HTTP client.
+# All calls to the OpenCap API (and downloads of the media it points to) go
+# through a single requests.Session so that TLS connections are kept alive and
+# reused, and transient errors (429/5xx) are retried with exponential backoff.
+class APIClient:
+    
+    def __init__(self, api_url=None, token=None, timeout=(10, 120),
+                 max_retries=5, backoff_factor=0.5, pool_maxsize=32):
+        
+        self.api_url = api_url if api_url is not None else get_api_url()
+        if self.api_url[-1] != '/':
+            self.api_url = self.api_url + '/'
+        # If token is None, it is resolved on first use (see get_token).
+        self.token = token
+        self._tokenLock = threading.Lock()
+        # (connect, read) timeouts in seconds.
+        self.timeout = timeout
+        
+        # Only idempotent methods are retried on 429/5xx responses; posting a
+        # result twice would duplicate it on the server. The last response is
+        # returned rather than raised so that callers can inspect the status.
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      raise_on_status=False,
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=pool_maxsize,
+                              pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+    def get_token(self):
+        # Resolve the token from the .env file, or by logging in, the first 
+        # time it is needed rather than when importing utils.
+        with self._tokenLock:
+            if self.token is None:
+                from utilsAuthentication import get_token
+                self.token = get_token()
+        return self.token
+        
+    def get_headers(self, token=None):
+        if token is None:
+            token = self.get_token()
+        return {"Authorization": "Token {}".format(token)}
+        
+    def request(self, method, endpoint, token=None, authenticate=True,
+                **kwargs):
+        # endpoint is either relative to the API url (eg, 'sessions/') or a
+        # full url (eg, a pre-signed media url). Media urls are typically
+        # pre-signed and must not carry the API token, use authenticate=False.
+        if endpoint.startswith('http://') or endpoint.startswith('https://'):
+            url = endpoint
+        else:
+            url = self.api_url + endpoint
+        headers = kwargs.pop('headers', {})
+        if authenticate:
+            headers = {**self.get_headers(token), **headers}
+        kwargs.setdefault('timeout', self.timeout)
+        
+        return self.session.request(method, url, headers=headers, **kwargs)
+    
+    def get(self, endpoint, **kwargs):
+        return self.request('GET', endpoint, **kwargs)
+    
+    def post(self, endpoint, **kwargs):
+        return self.request('POST', endpoint, **kwargs)
+    
+    def patch(self, endpoint, **kwargs):
+        return self.request('PATCH', endpoint, **kwargs)
+    
+    def delete(self, endpoint, **kwargs):
+        return self.request('DELETE', endpoint, **kwargs)
+    
+    def close(self):
+        self.session.close()
+
+_clientLock = threading.Lock()
+
+def get_client():
+    # The client is shared by the download threads, create it once.
+    if 'API_CLIENT' not in globals():
+        with _clientLock:
+            if 'API_CLIENT' not in globals():
+                global API_CLIENT
+                API_CLIENT = APIClient()
+        
+    return API_CLIENT
+
+# Replace the shared client, eg to change timeouts, retries, or to point the
+# module-level functions in utils.py to another server.
+def set_client(client):
+    global API_CLIENT
+    with _clientLock:
+        API_CLIENT = client
+    
+    return API_CLIENT
@@ -18,12 +18,11 @@
     limitations under the License.
 '''
 
-import requests
 from decouple import config
 import getpass
 import os
 import maskpass
-from utilsAPI import get_api_url
+from utilsAPI import get_api_url, get_client
 
 API_URL = get_api_url()
 
@@ -53,7 +52,8 @@ def get_token(saveEnvPath=None):
                     pw = getpass.getpass(prompt='Enter Password: ', stream=None)
                 
                 data = {"username":un,"password":pw}
-                resp = requests.post(API_URL + 'login/',data=data).json()
+                resp = get_client().post('login/', data=data,
+                                         authenticate=False).json()
                 token = resp['token']
                 
                 print('Login successful.')
@@ -0,0 +1,165 @@
+'''
+    ---------------------------------------------------------------------------
+    OpenCap processing: utilsCache.py
+    ---------------------------------------------------------------------------
+
+    Copyright 2022 Stanford University and the Authors
+
+    Author(s): Antoine Falisse, Scott Uhlrich
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not
+    use this file except in compliance with the License. You may obtain a copy
+    of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+'''
+
+# Opt-in cache of parsed text files (.trc, .mot, .sto). The parsed array is
+# saved as a .npy file, and its labels and header metadata as a .json file,
+# either next to the source file or in a cache directory. Cached arrays are
+# memory-mapped read-only. An entry is valid as long as the source file has
+# the same path, size and mtime; if only the mtime changed, the content hash
+# decides.
+#
+# The cache is disabled by default. Enable it with set_array_cache_dir, or by
+# setting ARRAY_CACHE_DIR (environment or .env file) to a directory, or to
+# 'sidecar' to store the cache files next to the source files.
+
+import os
+import json
+import hashlib
+import warnings
+import numpy as np
+
+from decouple import config
+
+ARRAY_CACHE_VERSION = 2
+SIDECAR = 'sidecar'
+
+_arrayCacheDir = None
+_arrayCacheDirSet = False
+
+def set_array_cache_dir(cacheDir):
+    # cacheDir: None to disable the cache, 'sidecar', or a directory.
+    global _arrayCacheDir, _arrayCacheDirSet
+    _arrayCacheDir = cacheDir
+    _arrayCacheDirSet = True
+
+def get_array_cache_dir():
+    if _arrayCacheDirSet:
+        return _arrayCacheDir
+    return config('ARRAY_CACHE_DIR', default=None)
+
+def get_file_hash(filePath, chunk_size=1024*1024):
+    sha256 = hashlib.sha256()
+    with open(filePath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def get_cache_paths(sourcePath, name, cacheDir=None):
+    # Returns the paths of the .npy and .json files caching the output of
+    # parser `name` for sourcePath.
+    if cacheDir is None:
+        cacheDir = get_array_cache_dir()
+    sourcePath = os.path.abspath(sourcePath)
+    fileName = os.path.basename(sourcePath)
+    if cacheDir == SIDECAR:
+        basePath = os.path.join(os.path.dirname(sourcePath),
+                                '.{}.{}'.format(fileName, name))
+    else:
+        pathHash = hashlib.sha1(sourcePath.encode('utf-8')).hexdigest()[:16]
+        basePath = os.path.join(cacheDir, '{}_{}.{}'.format(
+            pathHash, fileName, name))
+    return basePath + '.npy', basePath + '.json'
+
+def _load_entry(sourcePath, npyPath, jsonPath, stat):
+    try:
+        with open(jsonPath, 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (entry.get('version') != ARRAY_CACHE_VERSION or
+            entry.get('path') != os.path.abspath(sourcePath) or
+            entry.get('size') != stat.st_size):
+        return None
+    if entry.get('mtime_ns') != stat.st_mtime_ns:
+        # Touched or copied with a new mtime: still valid if the content is
+        # the same. Record the new mtime to skip the hash next time.
+        if entry.get('sha256') != get_file_hash(sourcePath):
+            return None
+        entry['mtime_ns'] = stat.st_mtime_ns
+        _write_json(jsonPath, entry)
+    try:
+        array = np.load(npyPath, mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    return array, entry['metadata']
+
+def _write_json(jsonPath, entry):
+    tmpPath = jsonPath + '.tmp{}'.format(os.getpid())
+    with open(tmpPath, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmpPath, jsonPath)
+
+def _write_entry(sourcePath, npyPath, jsonPath, stat, array, metadata):
+    os.makedirs(os.path.dirname(npyPath), exist_ok=True)
+    tmpPath = npyPath + '.tmp{}.npy'.format(os.getpid())
+    np.save(tmpPath, np.ascontiguousarray(array), allow_pickle=False)
+    os.replace(tmpPath, npyPath)
+    # The .json file is written last: an entry without it is ignored.
+    entry = {'version': ARRAY_CACHE_VERSION,
+             'path': os.path.abspath(sourcePath),
+             'size': stat.st_size,
+             'mtime_ns': stat.st_mtime_ns,
+             'sha256': get_file_hash(sourcePath),
+             'metadata': metadata}
+    _write_json(jsonPath, entry)
+
+def load_cached(sourcePath, name, parse, cacheDir=None):
+    """Returns parse(sourcePath), through the array cache if it is enabled.
+
+    Parameters
+    ----------
+    sourcePath : str
+        Path to the text file.
+    name : str
+        Name of the parser, such that different parsers of the same file get
+        different entries; e.g., 'TRCFile'.
+    parse : callable
+        parse(sourcePath) returns (array, metadata), with array a numeric
+        numpy array and metadata a json-serializable object.
+    cacheDir : str, optional
+        Overrides get_array_cache_dir().
+
+    Returns
+    -------
+    array : np.ndarray
+        Read-only memory-mapped array when loaded from the cache.
+    metadata : object
+    """
+    if cacheDir is None:
+        cacheDir = get_array_cache_dir()
+    if not cacheDir:
+        return parse(sourcePath)
+
+    npyPath, jsonPath = get_cache_paths(sourcePath, name, cacheDir)
+    stat = os.stat(sourcePath)
+    cached = _load_entry(sourcePath, npyPath, jsonPath, stat)
+    if cached is not None:
+        return cached
+
+    array, metadata = parse(sourcePath)
+    # Do not cache a file that changed while it was parsed.
+    newStat = os.stat(sourcePath)
+    if (newStat.st_size, newStat.st_mtime_ns) == (stat.st_size,
+                                                  stat.st_mtime_ns):
+        try:
+            _write_entry(sourcePath, npyPath, jsonPath, stat, array, metadata)
+        except OSError as e:
+            warnings.warn('Could not cache {}: {}'.format(sourcePath, e))
+    return array, metadata
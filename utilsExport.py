@@ -0,0 +1,249 @@
+'''
+    ---------------------------------------------------------------------------
+    OpenCap processing: utilsExport.py
+    ---------------------------------------------------------------------------
+
+    Copyright 2022 Stanford University and the Authors
+
+    Author(s): Antoine Falisse, Scott Uhlrich
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not
+    use this file except in compliance with the License. You may obtain a copy
+    of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+'''
+
+# Export of downloaded sessions to a columnar (Parquet) dataset, and queries
+# on that dataset. The dataset is partitioned by signal and session:
+#   <dataset_dir>/signal=<signal>/session=<session_id>/data.parquet
+# Each file has a trial and a time column, followed by the columns of the
+# signal, and one row group per trial, such that filters on trial and time
+# only read the matching row groups. Requires pyarrow (pip install pyarrow).
+#
+# Signals:
+#   coordinates: coordinate values, as returned by
+#       kinematics.get_coordinate_values() (read from the .mot file).
+#   markers: marker positions, with columns <marker>_x, <marker>_y and
+#       <marker>_z (read from the .trc file).
+#   center_of_mass: center of mass positions, as returned by
+#       kinematics.get_center_of_mass_values() (requires opensim).
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+from utils import read_storage
+from utilsTRC import trc_2_dict
+
+SIGNALS = ['coordinates', 'markers', 'center_of_mass']
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('The columnar export requires pyarrow: '
+                          'pip install pyarrow')
+    return pyarrow
+
+def get_trial_names(session_dir):
+    # Trials with kinematics in a downloaded session.
+    motionPaths = glob.glob(os.path.join(
+        session_dir, 'OpenSimData', 'Kinematics', '*.mot'))
+    return sorted(os.path.splitext(os.path.basename(motionPath))[0]
+                  for motionPath in motionPaths)
+
+def get_trial_signal(session_dir, trial_name, signal):
+    # Returns the signal of a trial as a DataFrame with a time column.
+    if signal == 'coordinates':
+        motionPath = os.path.join(session_dir, 'OpenSimData', 'Kinematics',
+                                  '{}.mot'.format(trial_name))
+        return read_storage(motionPath, outputFormat='dataframe')
+    elif signal == 'markers':
+        trcPath = os.path.join(session_dir, 'MarkerData',
+                               '{}.trc'.format(trial_name))
+        return marker_dict_to_dataframe(trc_2_dict(trcPath))
+    elif signal == 'center_of_mass':
+        from utilsKinematics import kinematics
+        return kinematics(session_dir, trial_name).get_center_of_mass_values()
+    else:
+        raise ValueError('Unknown signal {}, available signals: {}'.format(
+            signal, SIGNALS))
+
+def marker_dict_to_dataframe(markerDict):
+    columns = {'time': markerDict['time']}
+    for marker in markerDict['marker_names']:
+        for i, axis in enumerate('xyz'):
+            columns['{}_{}'.format(marker, axis)] = (
+                markerDict['markers'][marker][:, i])
+    return pd.DataFrame(columns)
+
+def dataframe_to_marker_dict(df):
+    # Inverse of marker_dict_to_dataframe, with the format of trc_2_dict.
+    marker_names = [column[:-2] for column in df.columns
+                    if column.endswith('_x') and
+                    column[:-2] + '_y' in df.columns]
+    markerDict = {'time': df['time'].to_numpy(),
+                  'marker_names': marker_names,
+                  'markers': {}}
+    for marker in marker_names:
+        markerDict['markers'][marker] = df[
+            [marker + '_x', marker + '_y', marker + '_z']].to_numpy()
+    return markerDict
+
+def export_session_parquet(session_dir, dataset_dir, session_id=None,
+                           trial_names=None, signals=('coordinates', 'markers'),
+                           compression='zstd'):
+    """Writes the signals of the trials of a downloaded session to the
+    Parquet dataset in dataset_dir. An existing export of the session is
+    replaced.
+
+    Parameters
+    ----------
+    session_dir : str
+        Path to the downloaded session (see utils.download_session).
+    dataset_dir : str
+        Root directory of the dataset.
+    session_id : str, optional
+        Defaults to the name of session_dir, without the OpenCapData_ prefix
+        of the folders of utils.download_session.
+    trial_names : list of str, optional
+        Defaults to all trials with kinematics.
+    signals : list of str, optional
+        Signals to export, among SIGNALS.
+    compression : str, optional
+        Parquet compression codec.
+
+    Returns
+    -------
+    paths : list of str
+        Written files.
+    """
+    pa = _import_pyarrow()
+    if session_id is None:
+        session_id = os.path.basename(os.path.normpath(session_dir))
+        if session_id.startswith('OpenCapData_'):
+            session_id = session_id[len('OpenCapData_'):]
+    if trial_names is None:
+        trial_names = get_trial_names(session_dir)
+
+    paths = []
+    for signal in signals:
+        dfs = {}
+        for trial_name in trial_names:
+            dfs[trial_name] = get_trial_signal(session_dir, trial_name, signal)
+        if not dfs:
+            continue
+        # Trials may have different columns (eg, markers): the file has all
+        # columns, with NaNs in the trials that do not have them.
+        columns = ['time']
+        for df in dfs.values():
+            columns += [c for c in df.columns if c not in columns]
+        schema = pa.schema([('trial', pa.string())] +
+                           [(c, pa.float64()) for c in columns])
+
+        outputDir = os.path.join(dataset_dir, 'signal={}'.format(signal),
+                                 'session={}'.format(session_id))
+        os.makedirs(outputDir, exist_ok=True)
+        outputPath = os.path.join(outputDir, 'data.parquet')
+        tmpPath = outputPath + '.tmp{}'.format(os.getpid())
+        with pa.parquet.ParquetWriter(tmpPath, schema,
+                                      compression=compression) as writer:
+            for trial_name, df in dfs.items():
+                df = df.reindex(columns=columns).astype(np.float64)
+                df.insert(0, 'trial', trial_name)
+                table = pa.Table.from_pandas(df, schema=schema,
+                                             preserve_index=False)
+                # One row group per trial.
+                writer.write_table(table, row_group_size=max(1, len(df)))
+        os.replace(tmpPath, outputPath)
+        paths.append(outputPath)
+
+    return paths
+
+def read_session_parquet(dataset_dir, signal, sessions=None, trials=None,
+                         time_range=None, columns=None):
+    """Reads a signal from the Parquet dataset in dataset_dir. The filters
+    are pushed down to the files (sessions) and row groups (trials, time).
+
+    Parameters
+    ----------
+    dataset_dir : str
+        Root directory of the dataset.
+    signal : str
+        One of SIGNALS.
+    sessions : list of str, optional
+        Sessions to read; all sessions by default.
+    trials : list of str, optional
+        Trials to read; all trials by default.
+    time_range : [float, float], optional
+        Start and end times (inclusive).
+    columns : list of str, optional
+        Signal columns to read; all columns by default.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        With columns session, trial, time, and the signal columns.
+    """
+    pa = _import_pyarrow()
+    ds = pa.dataset
+    signalDir = os.path.join(dataset_dir, 'signal={}'.format(signal))
+    if not os.path.isdir(signalDir):
+        raise FileNotFoundError('No {} data in {}'.format(signal, dataset_dir))
+    partitioning = ds.partitioning(pa.schema([('session', pa.string())]),
+                                   flavor='hive')
+    dataset = ds.dataset(signalDir, format='parquet',
+                         partitioning=partitioning)
+
+    # Sessions may have different columns: use the union of the schemas.
+    expression = None
+    if sessions is not None:
+        expression = ds.field('session').isin(list(sessions))
+    fragments = list(dataset.get_fragments(filter=expression))
+    schemas = [fragment.physical_schema for fragment in fragments]
+    if not schemas:
+        return pd.DataFrame(columns=['session', 'trial', 'time'] +
+                            (list(columns) if columns else []))
+    schema = pa.unify_schemas(schemas + [pa.schema(
+        [('session', pa.string())])])
+    dataset = ds.dataset(signalDir, format='parquet', schema=schema,
+                         partitioning=partitioning)
+
+    if trials is not None:
+        trialExpression = ds.field('trial').isin(list(trials))
+        expression = (trialExpression if expression is None else
+                      expression & trialExpression)
+    if time_range is not None:
+        timeExpression = ((ds.field('time') >= time_range[0]) &
+                          (ds.field('time') <= time_range[1]))
+        expression = (timeExpression if expression is None else
+                      expression & timeExpression)
+    if columns is None:
+        columns = [c for c in schema.names
+                   if c not in ['session', 'trial', 'time']]
+
+    table = dataset.to_table(
+        columns=['session', 'trial', 'time'] + list(columns),
+        filter=expression)
+    return table.to_pandas()
+
+def split_trials(df):
+    # Splits the output of read_session_parquet into one DataFrame per
+    # (session, trial), with a time column followed by the signal columns, as
+    # returned by get_coordinate_values(). Columns that are missing in a trial
+    # (all NaN) are dropped.
+    out = {}
+    for (session, trial), dfTrial in df.groupby(['session', 'trial'],
+                                                sort=False):
+        dfTrial = dfTrial.drop(columns=['session', 'trial'])
+        dfTrial = dfTrial.dropna(axis=1, how='all')
+        out[(session, trial)] = dfTrial.reset_index(drop=True)
+    return out
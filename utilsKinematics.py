@@ -19,148 +19,388 @@
 '''
 
 import os
-import opensim
 import copy
 import utils
 import numpy as np
 import pandas as pd
 import scipy.interpolate as interpolate
+import xml.etree.ElementTree as ET
 
 
 from utilsProcessing import lowPassFilter
-from utilsTRC import trc_2_dict
+from utilsSessionStore import open_session
+from utilsModelCache import get_model
 import numpy as np
 from scipy.spatial.transform import Rotation
 
 
+# Motion types of the coordinates of the joints (in the order of the
+# coordinates of the joint), as returned by Coordinate.getMotionType():
+# 1 for rotational and 2 for translational. See also
+# get_coordinate_motion_types for CustomJoints.
+JOINT_MOTION_TYPES = {
+    'WeldJoint': [],
+    'PinJoint': [1],
+    'SliderJoint': [2],
+    'UniversalJoint': [1, 1],
+    'BallJoint': [1, 1, 1],
+    'GimbalJoint': [1, 1, 1],
+    'EllipsoidJoint': [1, 1, 1],
+    'PlanarJoint': [1, 2, 2],
+    'FreeJoint': [1, 1, 1, 2, 2, 2]}
+
+# Motion types by (model path, size, mtime), see get_coordinate_motion_types.
+_coordinateMotionTypes = {}
+
+def get_coordinate_motion_types(modelPath):
+    """Returns the motion types of the coordinates of an .osim model, in the
+    order of the coordinate set, without loading the model in opensim. The
+    result is memoized as long as the model file does not change.
+
+    Returns
+    -------
+    motionTypes : dict or None
+        Coordinate name to motion type (1: rotational, 2: translational,
+        3: coupled). None if the model has joints of other types.
+    """
+    stat = os.stat(modelPath)
+    key = (os.path.abspath(modelPath), stat.st_size, stat.st_mtime_ns)
+    if key not in _coordinateMotionTypes:
+        _coordinateMotionTypes[key] = _parse_coordinate_motion_types(
+            modelPath)
+    motionTypes = _coordinateMotionTypes[key]
+    return None if motionTypes is None else dict(motionTypes)
+
+def _parse_coordinate_motion_types(modelPath):
+    root = ET.parse(modelPath).getroot()
+    motionTypes = {}
+    for joint in root.iter():
+        if not joint.tag.endswith('Joint'):
+            continue
+        coordinatesElt = joint.find('coordinates')
+        coordinates = [] if coordinatesElt is None else [
+            coordinate.get('name') 
+            for coordinate in coordinatesElt.findall('Coordinate')]
+        if joint.tag == 'CustomJoint':
+            # The first transform axis with a coordinate sets its motion type:
+            # rotational or translational if the function of the axis is
+            # linear, coupled otherwise.
+            jointMotionTypes = dict.fromkeys(coordinates)
+            for axis in joint.iter('TransformAxis'):
+                isRotation = axis.get('name', '').startswith('rotation')
+                isLinear = (axis.find('LinearFunction') is not None or
+                            axis.find('function/LinearFunction') is not None)
+                for coordinate in (axis.findtext('coordinates') or '').split():
+                    if (coordinate in jointMotionTypes and
+                            jointMotionTypes[coordinate] is None):
+                        jointMotionTypes[coordinate] = (
+                            (1 if isRotation else 2) if isLinear else 3)
+            if None in jointMotionTypes.values():
+                return None
+            motionTypes.update(jointMotionTypes)
+        elif (joint.tag in JOINT_MOTION_TYPES and
+              len(coordinates) == len(JOINT_MOTION_TYPES[joint.tag])):
+            motionTypes.update(zip(coordinates, JOINT_MOTION_TYPES[joint.tag]))
+        else:
+            return None
+    return motionTypes
+
+def _compute_muscle_data(modelPath, time, states, stateLabels, 
+                         compute_lengths, momentArmPairs):
+    # Computes the muscle-tendon lengths and the moment arms (muscle, 
+    # coordinate index pairs in momentArmPairs) for a chunk of frames of the
+    # states table. Runs in the joblib workers of kinematics.get_muscle_data.
+    import opensim
+    from utilsModelCache import checkout_model
+    opensim.Logger.setLevelString('error')
+    
+    with checkout_model(modelPath) as model:
+        table = opensim.TimeSeriesTable(
+            list(time), opensim.Matrix.createFromMat(
+                np.ascontiguousarray(states)), stateLabels)
+        table.addTableMetaDataString('inDegrees', 'no')
+        stateTrajectory = opensim.StatesTrajectory.createFromStatesTable(
+            model, table)
+        
+        muscles = []
+        forceSet = model.getForceSet()
+        for m in range(forceSet.getSize()):        
+            c_force_elt = forceSet.get(m)  
+            if 'Muscle' in c_force_elt.getConcreteClassName():
+                muscles.append(opensim.Muscle.safeDownCast(c_force_elt))
+        coordinateSet = model.getCoordinateSet()
+        coordinates = [coordinateSet.get(i) 
+                       for i in range(coordinateSet.getSize())]
+        
+        lMT = np.zeros((time.shape[0], len(muscles)))
+        dM = np.zeros((time.shape[0], len(muscles), len(coordinates)))
+        for i in range(time.shape[0]):
+            state = stateTrajectory[i]
+            model.realizePosition(state)
+            if compute_lengths:
+                for m, muscle in enumerate(muscles):
+                    lMT[i, m] = muscle.getLength(state)
+            for m, c in momentArmPairs:
+                dM[i, m, c] = muscles[m].computeMomentArm(
+                    state, coordinates[c])
+                
+    return lMT, dM
+
+def _compute_muscle_data_chunk(start, *args):
+    # _compute_muscle_data for the chunk of frames starting at start, which
+    # is returned with the outputs since chunks complete in any order.
+    return start, _compute_muscle_data(*args)
+
 class kinematics:
     
     def __init__(self, sessionDir, trialName, 
                  modelName=None,
-                 lowpass_cutoff_frequency_for_coordinate_values=-1):
+                 lowpass_cutoff_frequency_for_coordinate_values=-1,
+                 useSessionStore=True, lazy=False):
         
         self.lowpass_cutoff_frequency_for_coordinate_values = (
             lowpass_cutoff_frequency_for_coordinate_values)
         
-        # Model.
-        opensim.Logger.setLevelString('error')
+        # Session files are read from the session store if there is one
+        # (see utilsSessionStore), and from sessionDir otherwise.
+        self.sessionDir = sessionDir
+        self.session = open_session(sessionDir, useSessionStore)
         
-        modelBasePath = os.path.join(sessionDir, 'OpenSimData', 'Model')
+        # Model.
+        modelBasePath = 'OpenSimData/Model/'
         # Load model if specified, otherwise load the one that was on server
         if modelName is None:
-            modelName = utils.get_model_name_from_metadata(sessionDir)
-            modelPath = os.path.join(modelBasePath,modelName)
+            modelName = utils.get_model_name_from_metadata(
+                sessionDir, session=self.session)
+            modelRelPath = modelBasePath + modelName
         else:
-            modelPath = os.path.join(modelBasePath,
-                                 '{}.osim'.format(modelName))
+            modelRelPath = modelBasePath + '{}.osim'.format(modelName)
             
         # make sure model exists
-        if not os.path.exists(modelPath):
-            raise Exception('Model path: ' + modelPath + ' does not exist.')
-
-        self.model = opensim.Model(modelPath)
-        self.model.initSystem()
+        if not self.session.exists(modelRelPath):
+            raise Exception('Model path: ' + os.path.join(
+                sessionDir, modelRelPath) + ' does not exist.')
+        self.modelPath = self.session.get_path(modelRelPath)
+        
+        # Motion file with coordinate values, read through the session (from
+        # the parsed table if the session has a store).
+        self.motionRelPath = 'OpenSimData/Kinematics/{}.mot'.format(trialName)
+        if not self.session.exists(self.motionRelPath):
+            raise Exception('Motion path: ' + os.path.join(
+                sessionDir, self.motionRelPath) + ' does not exist.')
+        
+        # Initialize the model, the states table and the state trajectory.
+        # We will set them in other functions if they are needed.
+        self._model = None
+        self._stateTrajectory = None
         
-        # Motion file with coordinate values.
-        motionPath = os.path.join(sessionDir, 'OpenSimData', 'Kinematics',
-                                  '{}.mot'.format(trialName))
+        # In lazy mode, the model is only loaded, and the states table only
+        # built, when a method needs them (eg, center of mass, muscle-tendon
+        # lengths, moment arms); the coordinate values, speeds and 
+        # accelerations are computed from the motion file. Models with joints
+        # not supported by get_coordinate_motion_types are loaded right away.
+        motionTypes = None
+        if lazy:
+            motionTypes = get_coordinate_motion_types(self.modelPath)
+        if motionTypes is None:
+            self._load_model()
+        else:
+            self._read_coordinate_values(motionTypes)
+        
+        # TODO: hard coded
+        self.rootCoordinates = [
+            'pelvis_tilt', 'pelvis_list', 'pelvis_rotation',
+            'pelvis_tx', 'pelvis_ty', 'pelvis_tz']
+        
+        self.lumbarCoordinates = ['lumbar_extension', 'lumbar_bending', 
+                                  'lumbar_rotation']
+        
+        self.armCoordinates = ['arm_flex_r', 'arm_add_r', 'arm_rot_r', 
+                               'elbow_flex_r', 'pro_sup_r', 
+                               'arm_flex_l', 'arm_add_l', 'arm_rot_l', 
+                               'elbow_flex_l', 'pro_sup_l']
+        
+    def _process_motion_table(self, model=None):
+        # Returns the TimeSeriesTable of the motion file, filtered if 
+        # lowpass_cutoff_frequency_for_coordinate_values > 0, and, if model is
+        # specified, with absolute state names and in radians.
+        import opensim
+        opensim.Logger.setLevelString('error')
         
         # Create time-series table with coordinate values.             
-        self.table = opensim.TimeSeriesTable(motionPath)        
-        tableProcessor = opensim.TableProcessor(self.table)
-        self.columnLabels = list(self.table.getColumnLabels())
-        tableProcessor.append(opensim.TabOpUseAbsoluteStateNames())
-        self.time = np.asarray(self.table.getIndependentColumn())
-        
-        # Initialize the state trajectory. We will set it in other functions
-        # if it is needed.
-        self._stateTrajectory = None
+        data, labels = self.session.read_storage(self.motionRelPath)
+        table = opensim.TimeSeriesTable(
+            list(data[:, 0]), opensim.Matrix.createFromMat(
+                np.ascontiguousarray(data[:, 1:], dtype=np.float64)),
+            list(labels[1:]))
+        table.addTableMetaDataString('inDegrees', 'yes' if 
+            self.session.read_storage_in_degrees(self.motionRelPath) else 'no')
+        tableProcessor = opensim.TableProcessor(table)
+        self.columnLabels = list(table.getColumnLabels())
+        if model is not None:
+            tableProcessor.append(opensim.TabOpUseAbsoluteStateNames())
+        self.time = np.asarray(table.getIndependentColumn())
         
         # Filter coordinate values.
-        if lowpass_cutoff_frequency_for_coordinate_values > 0:
+        lowpass_cutoff_frequency = (
+            self.lowpass_cutoff_frequency_for_coordinate_values)
+        if lowpass_cutoff_frequency > 0:
             tableProcessor.append(
-                opensim.TabOpLowPassFilter(
-                    lowpass_cutoff_frequency_for_coordinate_values))
+                opensim.TabOpLowPassFilter(lowpass_cutoff_frequency))
 
         # Convert in radians.
-        self.table = tableProcessor.processAndConvertToRadians(self.model)
+        if model is not None:
+            table = tableProcessor.processAndConvertToRadians(model)
+        else:
+            table = tableProcessor.process()
         
         # Trim if filtered.
-        if lowpass_cutoff_frequency_for_coordinate_values > 0:
-            time_temp = self.table.getIndependentColumn()            
-            self.table.trim(
-                time_temp[self.table.getNearestRowIndexForTime(self.time[0])],
-                time_temp[self.table.getNearestRowIndexForTime(self.time[-1])])
-                
-        # Compute coordinate speeds and accelerations and add speeds to table.        
-        self.Qs = self.table.getMatrix().to_numpy()
-        self.Qds = np.zeros(self.Qs.shape)
-        self.Qdds = np.zeros(self.Qs.shape)
-        columnAbsoluteLabels = list(self.table.getColumnLabels())
-        for i, columnLabel in enumerate(columnAbsoluteLabels):
-            spline = interpolate.InterpolatedUnivariateSpline(
-                self.time, self.Qs[:,i], k=3)
-            # Coordinate speeds
-            splineD1 = spline.derivative(n=1)
-            self.Qds[:,i] = splineD1(self.time)
-            # Coordinate accelerations.
-            splineD2 = spline.derivative(n=2)
-            self.Qdds[:,i] = splineD2(self.time)            
-            # Add coordinate speeds to table.
-            columnLabel_speed = columnLabel[:-5] + 'speed'
-            self.table.appendColumn(
-                columnLabel_speed, 
-                opensim.Vector(self.Qds[:,i].flatten().tolist()))
+        if lowpass_cutoff_frequency > 0:
+            time_temp = table.getIndependentColumn()            
+            table.trim(
+                time_temp[table.getNearestRowIndexForTime(self.time[0])],
+                time_temp[table.getNearestRowIndexForTime(self.time[-1])])
+            
+        return table
+    
+    def _read_coordinate_values(self, motionTypes):
+        # Sets the coordinate values, speeds and accelerations without loading
+        # the model, with the motion types of the coordinates (see 
+        # get_coordinate_motion_types).
+        if self.lowpass_cutoff_frequency_for_coordinate_values > 0:
+            # Same filter as with the model.
+            table = self._process_motion_table()
+            Qs = table.getMatrix().to_numpy()
+        else:
+            data, labels = self.session.read_storage(self.motionRelPath)
+            self.time = np.array(data[:, 0], dtype=np.float64)
+            self.columnLabels = list(labels[1:])
+            Qs = np.array(data[:, 1:], dtype=np.float64)
+        
+        # Convert in radians, if in degrees (as processAndConvertToRadians).
+        if self.session.read_storage_in_degrees(self.motionRelPath):
+            idxColumnRotLabels = [i for i, columnLabel in enumerate(
+                self.columnLabels) if motionTypes.get(columnLabel) == 1]
+            Qs[:, idxColumnRotLabels] *= np.pi / 180
+        self._set_coordinate_values(Qs)
+        
+        # Coordinates.
+        self.coordinates = list(motionTypes.keys())
+        self.nCoordinates = len(self.coordinates)
+        self._set_coordinate_indices(motionTypes)
+        
+    def _set_coordinate_values(self, Qs):
+        # Compute coordinate speeds and accelerations.
+        # A single cubic interpolating spline through all columns (not-a-knot,
+        # the same spline as InterpolatedUnivariateSpline with k=3).
+        self.Qs = Qs
+        spline = interpolate.make_interp_spline(self.time, self.Qs, k=3,
+                                                axis=0)
+        # Coordinate speeds.
+        self.Qds = spline.derivative(nu=1)(self.time)
+        # Coordinate accelerations.
+        self.Qdds = spline.derivative(nu=2)(self.time)
+        
+    def _set_coordinate_indices(self, motionTypes):
+        # Find rotational and translational coordinates.
+        self.idxColumnTrLabels = [
+            self.columnLabels.index(i) for i in self.coordinates if \
+            motionTypes[i] == 2]
+        self.idxColumnRotLabels = [
+            self.columnLabels.index(i) for i in self.coordinates if \
+            motionTypes[i] == 1]
+        
+    def _load_model(self):
+        import opensim
+        opensim.Logger.setLevelString('error')
+        
+        # Copy of the model from the model pool (see utilsModelCache).
+        model = get_model(self.modelPath)
+        
+        table = self._process_motion_table(model)
+        self._set_coordinate_values(table.getMatrix().to_numpy())
             
-        # Append missing muscle states to table.
+        # Add coordinate speeds and missing muscle states to table.
         # Needed for StatesTrajectory.
-        stateVariableNames = self.model.getStateVariableNames()
+        columnAbsoluteLabels = list(table.getColumnLabels())
+        columnLabels_speed = [columnLabel[:-5] + 'speed'
+                              for columnLabel in columnAbsoluteLabels]
+        stateVariableNames = model.getStateVariableNames()
         stateVariableNamesStr = [
             stateVariableNames.get(i) for i in range(
                 stateVariableNames.getSize())]
-        existingLabels = self.table.getColumnLabels()
-        for stateVariableNameStr in stateVariableNamesStr:
-            if not stateVariableNameStr in existingLabels:
-                vec_0 = opensim.Vector([0] * self.table.getNumRows())            
-                self.table.appendColumn(stateVariableNameStr, vec_0)
+        existingLabels = set(columnAbsoluteLabels + columnLabels_speed)
+        missingLabels = [stateVariableNameStr
+                         for stateVariableNameStr in stateVariableNamesStr
+                         if not stateVariableNameStr in existingLabels]
+        self._table = self._build_table(
+            table,
+            np.hstack((self.Qs, self.Qds,
+                       np.zeros((self.Qs.shape[0], len(missingLabels))))),
+            columnAbsoluteLabels + columnLabels_speed + missingLabels)
                        
         # Number of muscles.
-        self.nMuscles = 0
-        self.forceSet = self.model.getForceSet()
-        for i in range(self.forceSet.getSize()):        
-            c_force_elt = self.forceSet.get(i)  
+        self._nMuscles = 0
+        self._forceSet = model.getForceSet()
+        for i in range(self._forceSet.getSize()):        
+            c_force_elt = self._forceSet.get(i)  
             if 'Muscle' in c_force_elt.getConcreteClassName():
-                self.nMuscles += 1
+                self._nMuscles += 1
                 
         # Coordinates.
-        self.coordinateSet = self.model.getCoordinateSet()
-        self.nCoordinates = self.coordinateSet.getSize()
-        self.coordinates = [self.coordinateSet.get(i).getName() 
+        self._coordinateSet = model.getCoordinateSet()
+        self.nCoordinates = self._coordinateSet.getSize()
+        self.coordinates = [self._coordinateSet.get(i).getName() 
                             for i in range(self.nCoordinates)]
-            
-        # Find rotational and translational coordinates.
-        self.idxColumnTrLabels = [
-            self.columnLabels.index(i) for i in self.coordinates if \
-            self.coordinateSet.get(i).getMotionType() == 2]
-        self.idxColumnRotLabels = [
-            self.columnLabels.index(i) for i in self.coordinates if \
-            self.coordinateSet.get(i).getMotionType() == 1]
-        
-        # TODO: hard coded
-        self.rootCoordinates = [
-            'pelvis_tilt', 'pelvis_list', 'pelvis_rotation',
-            'pelvis_tx', 'pelvis_ty', 'pelvis_tz']
-        
-        self.lumbarCoordinates = ['lumbar_extension', 'lumbar_bending', 
-                                  'lumbar_rotation']
-        
-        self.armCoordinates = ['arm_flex_r', 'arm_add_r', 'arm_rot_r', 
-                               'elbow_flex_r', 'pro_sup_r', 
-                               'arm_flex_l', 'arm_add_l', 'arm_rot_l', 
-                               'elbow_flex_l', 'pro_sup_l']
+        self._set_coordinate_indices(
+            {coordinate: self._coordinateSet.get(coordinate).getMotionType()
+             for coordinate in self.coordinates})
+        
+        self._model = model
+        
+    # Model-dependent attributes, loaded when first needed in lazy mode.
+    @property
+    def model(self):
+        if self._model is None:
+            self._load_model()
+        return self._model
+    
+    @property
+    def table(self):
+        self.model
+        return self._table
     
+    @property
+    def forceSet(self):
+        self.model
+        return self._forceSet
+    
+    @property
+    def nMuscles(self):
+        self.model
+        return self._nMuscles
+    
+    @property
+    def coordinateSet(self):
+        self.model
+        return self._coordinateSet
+    
+    @staticmethod
+    def _build_table(table, data, labels):
+        # Returns a TimeSeriesTable with the time and metadata of table, and
+        # the columns of data, built at once rather than column by column.
+        import opensim
+        newTable = opensim.TimeSeriesTable(
+            list(table.getIndependentColumn()),
+            opensim.Matrix.createFromMat(np.ascontiguousarray(data)), labels)
+        for key in table.getTableMetaDataKeys():
+            newTable.addTableMetaDataString(
+                key, table.getTableMetaDataAsString(key))
+        return newTable
+
     # Only set the state trajectory when needed because it is slow.
     def stateTrajectory(self):
+        import opensim
         if self._stateTrajectory is None:
             self._stateTrajectory = (
                 opensim.StatesTrajectory.createFromStatesTable(
@@ -168,16 +408,24 @@ class kinematics:
         return self._stateTrajectory
     
     def get_marker_dict(self, session_dir, trial_name, 
-                        lowpass_cutoff_frequency=-1):
+                        lowpass_cutoff_frequency=-1, markers=None,
+                        time_window=None):
         
-        trcFilePath = os.path.join(session_dir,
-                                   'MarkerData',
-                                   '{}.trc'.format(trial_name))
+        # Read from the session store of session_dir if there is one.
+        if os.path.normpath(session_dir) == os.path.normpath(self.sessionDir):
+            session = self.session
+        else:
+            session = open_session(session_dir)
         
-        markerDict = trc_2_dict(trcFilePath)
+        # If markers or time_window are specified, only these markers and
+        # frames are read from the file.
+        markerDict = session.read_trc_dict(
+            'MarkerData/{}.trc'.format(trial_name), markers=markers,
+            time_window=time_window)
         if lowpass_cutoff_frequency > 0:
+            time = self.time if time_window is None else markerDict['time']
             markerDict['markers'] = {
-                marker_name: lowPassFilter(self.time, data, lowpass_cutoff_frequency) 
+                marker_name: lowPassFilter(time, data, lowpass_cutoff_frequency) 
                 for marker_name, data in markerDict['markers'].items()}
         
         return markerDict
@@ -292,87 +540,139 @@ class kinematics:
         
         return coordinate_accelerations
     
-    def get_muscle_tendon_lengths(self, lowpass_cutoff_frequency=-1):
-        
-        # Compute muscle-tendon lengths.
-        lMT = np.zeros((self.table.getNumRows(), self.nMuscles))
-        for i in range(self.table.getNumRows()):
-            self.model.realizePosition(self.stateTrajectory()[i])
-            if i == 0:
-                muscleNames = [] 
-            for m in range(self.forceSet.getSize()):        
-                c_force_elt = self.forceSet.get(m)  
-                if 'Muscle' in c_force_elt.getConcreteClassName():
-                    cObj = opensim.Muscle.safeDownCast(c_force_elt)            
-                    lMT[i,m] = cObj.getLength(self.stateTrajectory()[i])
-                    if i == 0:
-                        muscleNames.append(c_force_elt.getName())
-                        
-        # Filter.
-        if lowpass_cutoff_frequency > 0:
-            lMT = lowPassFilter(self.time, lMT, lowpass_cutoff_frequency)                        
-              
-        # Return as DataFrame.
-        data = np.concatenate(
-            (np.expand_dims(self.time, axis=1), lMT), axis=1)
-        columns = ['time'] + muscleNames               
-        muscle_tendon_lengths = pd.DataFrame(data=data, columns=columns)
-        
-        return muscle_tendon_lengths
-    
-    def get_moment_arms(self, lowpass_cutoff_frequency=-1):
-        
-        # Compute moment arms.
-        dM =  np.zeros((self.table.getNumRows(), self.nMuscles, 
-                        self.nCoordinates))
-        for i in range(self.table.getNumRows()):            
-            self.model.realizePosition(self.stateTrajectory()[i])
-            if i == 0:
-                muscleNames = []
-            for m in range(self.forceSet.getSize()):        
-                c_force_elt = self.forceSet.get(m)  
-                if 'Muscle' in c_force_elt.getConcreteClassName():
-                    muscleName = c_force_elt.getName()
-                    cObj = opensim.Muscle.safeDownCast(c_force_elt)
-                    if i == 0:
-                        muscleNames.append(c_force_elt.getName())                    
-                    for c, coord in enumerate(self.coordinates):
-                        # We use prior knowledge to improve computation speed;
-                        # We do not want to compute moment arms that are not
-                        # relevant, eg for a muscle of the left side with 
-                        # respect to a coordinate of the right side.
-                        if muscleName[-2:] == '_l' and coord[-2:] == '_r':
-                            dM[i, m, c] = 0
-                        elif muscleName[-2:] == '_r' and coord[-2:] == '_l':
-                            dM[i, m, c] = 0
-                        elif (coord in self.rootCoordinates or 
-                              coord in self.lumbarCoordinates or 
-                              coord in self.armCoordinates):
-                            dM[i, m, c] = 0
-                        else:
-                            coordinate = self.coordinateSet.get(
-                                self.coordinates.index(coord))
-                            dM[i, m, c] = cObj.computeMomentArm(
-                                self.stateTrajectory()[i], coordinate)
-                            
-        # Clean numerical artefacts (ie, moment arms smaller than 1e-5 m).
-        dM[np.abs(dM) < 1e-5] = 0
-        
-        # Filter.
-        if lowpass_cutoff_frequency > 0:            
-            for c, coord in enumerate(self.coordinates):
-                dM[:, :, c] = lowPassFilter(self.time, dM[:, :, c], 
-                                            lowpass_cutoff_frequency)
-        
-        # Return as DataFrame.
-        moment_arms = {}
-        for c, coord in enumerate(self.coordinates):
+    def get_muscle_data(self, lowpass_cutoff_frequency=-1,
+                        compute_lengths=True, compute_moment_arms=True,
+                        n_jobs=1, chunk_size=None, progress=None):
+        """Computes the muscle-tendon lengths and moment arms in a single pass
+        over the frames. The frames are split into chunks that are processed
+        in parallel by n_jobs joblib workers; each worker loads the model
+        once (see utilsModelCache).
+
+        Parameters
+        ----------
+        lowpass_cutoff_frequency : float, optional
+            Cutoff frequency of the low-pass filter; no filter if <= 0.
+        compute_lengths, compute_moment_arms : bool, optional
+            Outputs to compute.
+        n_jobs : int, optional
+            Number of workers, as in joblib.Parallel (-1 for all CPUs).
+        chunk_size : int, optional
+            Number of frames per chunk; by default, such that each worker
+            processes about 4 chunks.
+        progress : callable, optional
+            Called as progress(nFramesDone, nFrames) as chunks complete.
+
+        Returns
+        -------
+        muscle_tendon_lengths : pd.DataFrame or None
+        moment_arms : dict of pd.DataFrame or None
+            See get_muscle_tendon_lengths and get_moment_arms.
+        """
+        from joblib import Parallel, delayed, cpu_count
+        
+        # Muscles as ordered in the force set.
+        muscleNames = []
+        for m in range(self.forceSet.getSize()):        
+            c_force_elt = self.forceSet.get(m)  
+            if 'Muscle' in c_force_elt.getConcreteClassName():
+                muscleNames.append(c_force_elt.getName())
+                
+        # Moment arms to compute. We use prior knowledge to improve
+        # computation speed; we do not want to compute moment arms that are
+        # not relevant, eg for a muscle of the left side with respect to a 
+        # coordinate of the right side.
+        momentArmPairs = []
+        if compute_moment_arms:
+            for m, muscleName in enumerate(muscleNames):
+                for c, coord in enumerate(self.coordinates):
+                    if muscleName[-2:] == '_l' and coord[-2:] == '_r':
+                        continue
+                    elif muscleName[-2:] == '_r' and coord[-2:] == '_l':
+                        continue
+                    elif (coord in self.rootCoordinates or 
+                          coord in self.lumbarCoordinates or 
+                          coord in self.armCoordinates):
+                        continue
+                    momentArmPairs.append((m, c))
+        
+        # Split the states table into chunks of frames.
+        time = np.asarray(self.table.getIndependentColumn())
+        states = self.table.getMatrix().to_numpy()
+        stateLabels = list(self.table.getColumnLabels())
+        nFrames = time.shape[0]
+        if n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        if chunk_size is None:
+            chunk_size = int(np.ceil(nFrames / (4 * max(n_jobs, 1))))
+        chunk_size = max(chunk_size, 1)
+        chunks = [(i, min(i + chunk_size, nFrames)) 
+                  for i in range(0, nFrames, chunk_size)]
+        
+        # Compute muscle-tendon lengths and moment arms. All chunks are
+        # submitted at once, and are collected (and progress reported) as 
+        # they complete, in any order.
+        lMT = np.zeros((nFrames, len(muscleNames)))
+        dM = np.zeros((nFrames, len(muscleNames), self.nCoordinates))
+        nFramesDone = 0
+        outputs = Parallel(n_jobs=n_jobs, return_as='generator_unordered')(
+            delayed(_compute_muscle_data_chunk)(
+                start, self.modelPath, time[start:end], states[start:end],
+                stateLabels, compute_lengths, momentArmPairs)
+            for start, end in chunks)
+        for start, (lMT_chunk, dM_chunk) in outputs:
+            end = start + lMT_chunk.shape[0]
+            lMT[start:end] = lMT_chunk
+            dM[start:end] = dM_chunk
+            nFramesDone += end - start
+            if progress is not None:
+                progress(nFramesDone, nFrames)
+                    
+        muscle_tendon_lengths = None
+        if compute_lengths:
+            # Filter.
+            if lowpass_cutoff_frequency > 0:
+                lMT = lowPassFilter(self.time, lMT, lowpass_cutoff_frequency)
+            
+            # Return as DataFrame.
             data = np.concatenate(
-                (np.expand_dims(self.time, axis=1), dM[:,:,c]), axis=1)
-            columns = ['time'] + muscleNames
-            moment_arms[coord] = pd.DataFrame(data=data, columns=columns)
+                (np.expand_dims(self.time, axis=1), lMT), axis=1)
+            columns = ['time'] + muscleNames               
+            muscle_tendon_lengths = pd.DataFrame(data=data, columns=columns)
+                              
+        moment_arms = None
+        if compute_moment_arms:
+            # Clean numerical artefacts (ie, moment arms smaller than 1e-5 m).
+            dM[np.abs(dM) < 1e-5] = 0
+            
+            # Filter.
+            if lowpass_cutoff_frequency > 0:            
+                for c, coord in enumerate(self.coordinates):
+                    dM[:, :, c] = lowPassFilter(self.time, dM[:, :, c], 
+                                                lowpass_cutoff_frequency)
+            
+            # Return as DataFrame.
+            moment_arms = {}
+            for c, coord in enumerate(self.coordinates):
+                data = np.concatenate(
+                    (np.expand_dims(self.time, axis=1), dM[:,:,c]), axis=1)
+                columns = ['time'] + muscleNames
+                moment_arms[coord] = pd.DataFrame(data=data, columns=columns)
             
-        return moment_arms
+        return muscle_tendon_lengths, moment_arms
+    
+    def get_muscle_tendon_lengths(self, lowpass_cutoff_frequency=-1, 
+                                  n_jobs=1, progress=None):
+        # See get_muscle_data.
+        return self.get_muscle_data(
+            lowpass_cutoff_frequency=lowpass_cutoff_frequency,
+            compute_moment_arms=False, n_jobs=n_jobs, progress=progress)[0]
+    
+    def get_moment_arms(self, lowpass_cutoff_frequency=-1, n_jobs=1,
+                        progress=None):
+        # See get_muscle_data.
+        return self.get_muscle_data(
+            lowpass_cutoff_frequency=lowpass_cutoff_frequency,
+            compute_lengths=False, n_jobs=n_jobs, progress=progress)[1]
     
     def compute_center_of_mass(self):        
         
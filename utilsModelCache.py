@@ -0,0 +1,153 @@
+'''
+    ---------------------------------------------------------------------------
+    OpenCap processing: utilsModelCache.py
+    ---------------------------------------------------------------------------
+
+    Copyright 2022 Stanford University and the Authors
+
+    Author(s): Antoine Falisse, Scott Uhlrich
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not
+    use this file except in compliance with the License. You may obtain a copy
+    of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+'''
+
+# Process-wide pool of OpenSim models, such that analyzing several trials of a
+# session parses the (scaled) model once. For each model file, the pool keeps
+# the parsed model as a template that is never handed out, and initialized
+# instances for checkout. Entries are keyed by the absolute path of the model
+# file and are valid as long as the file has the same size and mtime; if only
+# the mtime changed, the content hash decides. The least recently used models
+# are evicted beyond MODEL_CACHE_SIZE models (environment or .env file,
+# default 4; 0 disables the pool).
+#
+# Two ways to get a model:
+#   get_model returns a new model, copied from the template (much faster than
+#       parsing the file), that the caller owns and may modify.
+#   checkout_model lends an initialized model for the duration of a with
+#       block, and takes it back at the end of the block. The model must not
+#       be modified (eg, adding or removing components).
+
+import os
+import threading
+import contextlib
+from collections import OrderedDict
+
+from decouple import config
+
+from utilsCache import get_file_hash
+
+class _ModelEntry(object):
+    def __init__(self, modelPath, stat, template):
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.sha256 = get_file_hash(modelPath)
+        self.template = template
+        # Initialized models that are not checked out.
+        self.idle = []
+
+class ModelCache(object):
+    """LRU pool of OpenSim models, see the module description.
+
+    """
+    def __init__(self, maxSize=4):
+        self.maxSize = maxSize
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _get_entry(self, modelPath):
+        # Returns the entry of modelPath, (re)loading the model if needed.
+        # Call with the lock held.
+        import opensim
+        opensim.Logger.setLevelString('error')
+
+        modelPath = os.path.abspath(modelPath)
+        stat = os.stat(modelPath)
+        entry = self._entries.get(modelPath)
+        if entry is not None and (entry.size != stat.st_size or (
+                entry.mtime_ns != stat.st_mtime_ns and
+                entry.sha256 != get_file_hash(modelPath))):
+            entry = None
+        if entry is None:
+            entry = _ModelEntry(modelPath, stat, opensim.Model(modelPath))
+            self._entries[modelPath] = entry
+        entry.mtime_ns = stat.st_mtime_ns
+        self._entries.move_to_end(modelPath)
+        while len(self._entries) > max(self.maxSize, 1):
+            self._entries.popitem(last=False)
+        return entry
+
+    def get_model(self, modelPath, initSystem=True):
+        import opensim
+        if self.maxSize <= 0:
+            model = opensim.Model(modelPath)
+        else:
+            with self._lock:
+                model = opensim.Model(self._get_entry(modelPath).template)
+        if initSystem:
+            model.initSystem()
+        return model
+
+    @contextlib.contextmanager
+    def checkout_model(self, modelPath):
+        if self.maxSize <= 0:
+            model = self.get_model(modelPath)
+            yield model
+            return
+
+        with self._lock:
+            entry = self._get_entry(modelPath)
+            model = entry.idle.pop() if entry.idle else None
+        if model is None:
+            model = self.get_model(modelPath)
+        try:
+            yield model
+        finally:
+            # The model is not returned if its entry was evicted or reloaded.
+            with self._lock:
+                if self._entries.get(os.path.abspath(modelPath)) is entry:
+                    entry.idle.append(model)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_modelCache = ModelCache(config('MODEL_CACHE_SIZE', default=4, cast=int))
+
+def get_model_cache():
+    return _modelCache
+
+def get_model(modelPath, initSystem=True):
+    """Returns a new opensim.Model of modelPath, copied from the model pool.
+    The caller owns the model and may modify it.
+
+    Parameters
+    ----------
+    modelPath : str
+        Path to the .osim file.
+    initSystem : bool, optional
+        Call initSystem on the model, as needed before using it.
+
+    Returns
+    -------
+    model : opensim.Model
+    """
+    return _modelCache.get_model(modelPath, initSystem=initSystem)
+
+def checkout_model(modelPath):
+    """Lends an initialized opensim.Model of modelPath from the model pool,
+    for use in a with block; e.g.,
+
+        with checkout_model(modelPath) as model:
+            muscles = model.getMuscles()
+
+    The model must not be modified, nor used after the block.
+
+    """
+    return _modelCache.checkout_model(modelPath)
@@ -24,11 +24,12 @@ import sys
 sys.path.append(os.path.join(pathFile, 'ActivityAnalyses'))
 
 import logging
-import opensim
+import tempfile
+import itertools
 import numpy as np
 from scipy import signal
-import matplotlib.pyplot as plt
 from utils import storage_to_dataframe, download_trial, get_trial_id
+from utilsModelCache import get_model
 
 def lowPassFilter(time, data, lowpass_cutoff_frequency, order=4):
     
@@ -39,6 +40,123 @@ def lowPassFilter(time, data, lowpass_cutoff_frequency, order=4):
 
     return dataFilt
 
+# %% Streaming counterparts of lowPassFilter and of the ranges of motion, for
+# (data, labels) blocks as yielded by utils.iter_storage_chunks.
+def lowPassFilterChunks(chunks, lowpass_cutoff_frequency, order=4, fs=None,
+                        timeLabel='time', tmpDir=None):
+    # Zero-phase filter equivalent to lowPassFilter (sosfiltfilt, with the
+    # same odd padding) applied to all columns but timeLabel, in bounded 
+    # memory. The blocks are first written to a temporary file, then the
+    # forward pass runs block by block with the filter state and overwrites
+    # the file, and the backward pass overwrites it again from the end. The
+    # filtered blocks are yielded once the whole input has been consumed. If
+    # fs is None, it is estimated from the whole time column, as in 
+    # lowPassFilter (only the time column is kept in memory).
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    labels = first[1]
+    iTime = labels.index(timeLabel) if timeLabel in labels else None
+    idxData = [i for i in range(len(labels)) if i != iTime]
+    if fs is None and iTime is None:
+        raise ValueError('No {} column: specify fs.'.format(timeLabel))
+    
+    fd, tmpPath = tempfile.mkstemp(suffix='.bin', dir=tmpDir)
+    try:
+        # Copy the blocks to the temporary file.
+        bounds = []
+        nRows = 0
+        times = []
+        with os.fdopen(fd, 'wb') as f:
+            for block in itertools.chain(
+                    [first[0]], (chunk[0] for chunk in chunks)):
+                np.asarray(block, dtype=np.float64).tofile(f)
+                bounds.append((nRows, nRows + block.shape[0]))
+                nRows += block.shape[0]
+                if fs is None:
+                    times.append(np.array(block[:, iTime], dtype=np.float64))
+        if nRows == 0:
+            return
+        y = np.memmap(tmpPath, dtype=np.float64, mode='r+', 
+                      shape=(nRows, len(labels)))
+        
+        if fs is None:
+            if nRows < 2:
+                raise ValueError('A single sample: specify fs.')
+            fs = 1/np.round(np.mean(np.diff(np.concatenate(times))),16)
+            del times
+        wn = lowpass_cutoff_frequency/(fs/2)
+        sos = signal.butter(order/2, wn, btype='low', output='sos')
+        # Padding length, as in signal.sosfiltfilt.
+        ntaps = 2 * sos.shape[0] + 1
+        ntaps -= min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        edge = 3 * ntaps
+        
+        if nRows <= edge:
+            # Short signal: filter in memory (sosfiltfilt raises if too 
+            # short).
+            data = np.array(y)
+            data[:, idxData] = signal.sosfiltfilt(sos, data[:, idxData], 
+                                                  axis=0)
+            del y
+            yield data, labels
+            return
+        
+        # The padding uses the first and last edge+1 rows.
+        x = np.array(y[:edge+1, idxData])
+        tail = np.array(y[-(edge+1):, idxData])
+        zi = signal.sosfilt_zi(sos)[:, :, np.newaxis]
+        left = 2 * x[0] - x[edge:0:-1]
+        _, z = signal.sosfilt(sos, left, axis=0, zi=zi * left[0])
+        
+        # Forward pass.
+        for start, end in bounds:
+            y[start:end, idxData], z = signal.sosfilt(
+                sos, y[start:end, idxData], axis=0, zi=z)
+        right = 2 * tail[-1] - tail[-2::-1]
+        yRight, _ = signal.sosfilt(sos, right, axis=0, zi=z)
+        
+        # Backward pass.
+        _, z = signal.sosfilt(sos, yRight[::-1], axis=0, zi=zi * yRight[-1])
+        for start, end in reversed(bounds):
+            yBlock, z = signal.sosfilt(sos, y[start:end, idxData][::-1], 
+                                       axis=0, zi=z)
+            y[start:end, idxData] = yBlock[::-1]
+            
+        for start, end in bounds:
+            yield np.array(y[start:end]), labels
+        del y
+    finally:
+        os.remove(tmpPath)
+
+def get_ranges_of_motion_from_chunks(chunks, columns=None):
+    # Min, max, and amplitude of each column (but time), in the units of the
+    # data (eg, degrees for rotations in OpenCap .mot files), in one pass.
+    # NaNs are ignored, as with pandas.
+    mins, maxs = None, None
+    for data, labels in chunks:
+        if mins is None:
+            if columns is None:
+                columns = [label for label in labels if label != 'time']
+            idx = [labels.index(column) for column in columns]
+            mins = np.fmin.reduce(data[:, idx], axis=0)
+            maxs = np.fmax.reduce(data[:, idx], axis=0)
+        else:
+            mins = np.fmin(mins, np.fmin.reduce(data[:, idx], axis=0))
+            maxs = np.fmax(maxs, np.fmax.reduce(data[:, idx], axis=0))
+    
+    ROM = {}
+    if mins is None:
+        return ROM
+    for c, coord in enumerate(columns):
+        ROM[coord] = {}
+        ROM[coord]['min'] = mins[c]
+        ROM[coord]['max'] = maxs[c]
+        ROM[coord]['amplitude'] = maxs[c] - mins[c]
+        
+    return ROM
+
 # %% Segment gait
 def segment_gait(session_id, trial_name, data_folder, gait_cycles_from_end=0):
     
@@ -91,6 +209,7 @@ def segment_squats(ikFilePath, pelvis_ty=None, timeVec=None, visualize=False,
     startFinishTimes = [timeVec[i].tolist() for i in startFinishInds]
     
     if visualize:
+        import matplotlib.pyplot as plt
         plt.figure()     
         plt.plot(-pelvSignal)
         for c_v, val in enumerate(startFinishInds):
@@ -196,6 +315,7 @@ def segment_STS(ikFilePath, pelvis_ty=None, timeVec=None, velSeated=0.3,
         timeVec[i].tolist() for i in startFinishIndsDelayPeriodic]
     
     if visualize:        
+        import matplotlib.pyplot as plt
         plt.figure()     
         plt.plot(pelvSignal)
         for c_v, val in enumerate(startFinishInds):
@@ -267,9 +387,10 @@ def adjust_muscle_wrapping(
                         level=logging.INFO)
     
     # Load models.
+    import opensim
     opensim.Logger.setLevelString('error')
-    unscaledModel = opensim.Model(pathUnscaledModel)
-    scaledModel = opensim.Model(pathScaledModel)    
+    unscaledModel = get_model(pathUnscaledModel, initSystem=False)
+    scaledModel = get_model(pathScaledModel, initSystem=False)
     scaledBodySet = scaledModel.getBodySet()
     
     # Poses that often cause problems.
@@ -550,8 +671,9 @@ def generate_model_with_contacts(
     transition_velocity = 0.2
     
     # Add contact spheres and SmoothSphereHalfSpaceForces.
+    import opensim
     opensim.Logger.setLevelString('error')
-    model = opensim.Model(pathOutputFiles + ".osim")   
+    model = get_model(pathOutputFiles + ".osim", initSystem=False)
     bodySet = model.get_BodySet()
     
     # ContactHalfSpace.
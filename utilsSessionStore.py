@@ -0,0 +1,300 @@
+'''
+    ---------------------------------------------------------------------------
+    OpenCap processing: utilsSessionStore.py
+    ---------------------------------------------------------------------------
+
+    Copyright 2022 Stanford University and the Authors
+
+    Author(s): Antoine Falisse, Scott Uhlrich
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not
+    use this file except in compliance with the License. You may obtain a copy
+    of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+'''
+
+# Single-file store of a downloaded session (HDF5, chunked and compressed),
+# such that reading a session opens one file rather than hundreds, which
+# matters on network filesystems. Requires h5py (pip install h5py).
+#
+# The store (opencapSession.h5, in the session folder) contains:
+#   files/<relative path>: the raw bytes of every file of the session, but
+#       the videos and geometries (see SESSION_STORE_EXCLUDE).
+#   arrays/<relative path>: for .trc, .mot and .sto files, the parsed table,
+#       with the header (.trc) or the column labels (.mot, .sto) as a json
+#       attribute, and whether the rotations are in degrees (.mot, .sto).
+# The size and mtime of the stored files are recorded (sources attribute).
+#
+# open_session returns a reader of the session files, from the store if there
+# is one and none of the stored files changed on disk since, or from the
+# session folder otherwise; kinematics and gait_analysis read the session
+# through it. download_kinematics rewrites an existing store.
+
+import os
+import json
+import shutil
+import tempfile
+import weakref
+import yaml
+import numpy as np
+
+from utils import _read_storage_table, _read_storage_in_degrees, read_storage
+from utilsTRC import _read_trc_table, _trc_table_to_dict, trc_2_dict
+
+SESSION_STORE_FILENAME = 'opencapSession.h5'
+SESSION_STORE_VERSION = 2
+# Relative paths (with '/') of the folders that are not stored.
+SESSION_STORE_EXCLUDE = ['Videos', 'OpenSimData/Model/Geometry']
+SESSION_STORE_CHUNK_ROWS = 1024
+
+def _import_h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('The session store requires h5py: pip install h5py')
+    return h5py
+
+def _list_session_files(session_path, exclude):
+    relPaths = []
+    for root, dirs, files in os.walk(session_path):
+        relRoot = os.path.relpath(root, session_path).replace(os.sep, '/')
+        relRoot = '' if relRoot == '.' else relRoot + '/'
+        dirs[:] = sorted(d for d in dirs if relRoot + d not in exclude)
+        for file in sorted(files):
+            # Skip the store, temporary files, and cache sidecars.
+            if (file.startswith('.') or file == SESSION_STORE_FILENAME or
+                    '.tmp' in file or file.endswith('.part')):
+                continue
+            relPaths.append(relRoot + file)
+    return relPaths
+
+def write_session_store(session_path, exclude=SESSION_STORE_EXCLUDE,
+                        compression='gzip', compression_opts=4):
+    """Writes the files of the session in session_path to a single store
+    file, replacing the previous store.
+
+    Returns
+    -------
+    storePath : str
+    """
+    h5py = _import_h5py()
+    storePath = os.path.join(session_path, SESSION_STORE_FILENAME)
+    tmpPath = storePath + '.tmp{}'.format(os.getpid())
+    options = {'compression': compression,
+               'compression_opts': compression_opts}
+
+    sources = {}
+    with h5py.File(tmpPath, 'w') as store:
+        store.attrs['version'] = SESSION_STORE_VERSION
+        for relPath in _list_session_files(session_path, exclude):
+            filePath = os.path.join(session_path, *relPath.split('/'))
+            with open(filePath, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                content = np.frombuffer(f.read(), dtype=np.uint8)
+            sources[relPath] = [stat.st_size, stat.st_mtime_ns]
+            if content.size > 0:
+                store.create_dataset('files/' + relPath, data=content,
+                                     chunks=True, **options)
+            else:
+                store.create_dataset('files/' + relPath, shape=(0,),
+                                     dtype=np.uint8)
+
+            extension = os.path.splitext(relPath)[1].lower()
+            try:
+                if extension == '.trc':
+                    table, header = _read_trc_table(filePath)
+                    attrs = {'header': json.dumps(header)}
+                elif extension in ['.mot', '.sto']:
+                    table, metadata = _read_storage_table(filePath)
+                    attrs = {'labels': json.dumps(metadata['labels']),
+                             'inDegrees': _read_storage_in_degrees(filePath)}
+                else:
+                    continue
+            except ValueError as e:
+                # Eg, a storage file without endheader: raw bytes only.
+                print('Not storing {} as an array: {}'.format(relPath, e))
+                continue
+            chunks = (max(1, min(SESSION_STORE_CHUNK_ROWS, table.shape[0])),
+                      max(1, table.shape[1]))
+            dataset = store.create_dataset(
+                'arrays/' + relPath, data=table,
+                chunks=chunks if table.size > 0 else None,
+                **(options if table.size > 0 else {}))
+            for key, value in attrs.items():
+                dataset.attrs[key] = value
+        store.attrs['sources'] = json.dumps(sources)
+    os.replace(tmpPath, storePath)
+
+    return storePath
+
+class SessionFolder(object):
+    """Reads the files of a session from the session folder. Paths are
+    relative to the session folder, with '/' separators; e.g.,
+    'MarkerData/walk.trc'.
+
+    """
+    def __init__(self, session_path):
+        self.session_path = session_path
+
+    def get_path(self, relPath):
+        return os.path.join(self.session_path, *relPath.split('/'))
+
+    def exists(self, relPath):
+        return os.path.exists(self.get_path(relPath))
+
+    def read_bytes(self, relPath):
+        with open(self.get_path(relPath), 'rb') as f:
+            return f.read()
+
+    def read_metadata(self):
+        return yaml.load(self.read_bytes('sessionMetadata.yaml'),
+                         Loader=yaml.FullLoader)
+
+    def read_storage(self, relPath):
+        # Returns (data, labels), see utils.read_storage.
+        return read_storage(self.get_path(relPath))
+
+    def read_storage_in_degrees(self, relPath):
+        # Whether the rotations of a storage file are in degrees (inDegrees).
+        return _read_storage_in_degrees(self.get_path(relPath))
+
+    def read_trc_dict(self, relPath, rotation=None, markers=None,
+                      time_window=None):
+        # See trc_2_dict.
+        return trc_2_dict(self.get_path(relPath), rotation=rotation,
+                          markers=markers, time_window=time_window)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SessionStore(SessionFolder):
+    """Reads the files of a session from its store (see write_session_store).
+    Libraries that need a file path (e.g., opensim) get a copy of the file,
+    extracted to a temporary folder that is removed when the store is closed.
+    Files that are not in the store (e.g., downloaded after the store was
+    written) are read from the session folder.
+
+    """
+    def __init__(self, session_path):
+        h5py = _import_h5py()
+        self.session_path = session_path
+        self._folder = SessionFolder(session_path)
+        self._store = h5py.File(
+            os.path.join(session_path, SESSION_STORE_FILENAME), 'r')
+        # Temporary folder with the extracted files, if any.
+        self._tmpDirs = []
+        self._finalizer = weakref.finalize(self, SessionStore._cleanup,
+                                           self._store, self._tmpDirs)
+
+    @staticmethod
+    def _cleanup(store, tmpDirs):
+        store.close()
+        for tmpDir in tmpDirs:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    def _in_store(self, relPath):
+        return 'files/' + relPath in self._store
+
+    def exists(self, relPath):
+        return self._in_store(relPath) or self._folder.exists(relPath)
+
+    def read_bytes(self, relPath):
+        if not self._in_store(relPath):
+            return self._folder.read_bytes(relPath)
+        return self._store['files/' + relPath][()].tobytes()
+
+    def get_path(self, relPath):
+        if not self._in_store(relPath):
+            return self._folder.get_path(relPath)
+        if not self._tmpDirs:
+            self._tmpDirs.append(tempfile.mkdtemp(prefix='opencapSession'))
+        filePath = os.path.join(self._tmpDirs[0], *relPath.split('/'))
+        if not os.path.exists(filePath):
+            os.makedirs(os.path.dirname(filePath), exist_ok=True)
+            with open(filePath, 'wb') as f:
+                f.write(self.read_bytes(relPath))
+        return filePath
+
+    def _read_array(self, relPath, key):
+        dataset = self._store['arrays/' + relPath]
+        return dataset[()], json.loads(dataset.attrs[key])
+
+    def read_storage(self, relPath):
+        # Files without a parsed table are read from their bytes.
+        if 'arrays/' + relPath not in self._store:
+            return read_storage(self.get_path(relPath))
+        return self._read_array(relPath, 'labels')
+
+    def read_storage_in_degrees(self, relPath):
+        if 'arrays/' + relPath in self._store:
+            attrs = self._store['arrays/' + relPath].attrs
+            if 'inDegrees' in attrs:
+                return bool(attrs['inDegrees'])
+        return _read_storage_in_degrees(self.get_path(relPath))
+
+    def is_stale(self):
+        # True if a stored file changed or was removed on disk since the store
+        # was written. Only the stored files are checked, the session folder
+        # is not listed; files added since are read from the folder.
+        if 'sources' not in self._store.attrs:
+            # Store written by a previous version.
+            return _is_stale_by_listing(self.session_path)
+        sources = json.loads(self._store.attrs['sources'])
+        for relPath, (size, mtime_ns) in sources.items():
+            try:
+                stat = os.stat(self._folder.get_path(relPath))
+            except OSError:
+                return True
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return True
+        return False
+
+    def read_trc_dict(self, relPath, rotation=None, markers=None,
+                      time_window=None):
+        if 'arrays/' + relPath not in self._store:
+            return trc_2_dict(self.get_path(relPath), rotation=rotation,
+                              markers=markers, time_window=time_window)
+        table, header = self._read_array(relPath, 'header')
+        return _trc_table_to_dict(table, header, rotation=rotation,
+                                  markers=markers, time_window=time_window)
+
+    def close(self):
+        self._finalizer()
+
+def has_session_store(session_path):
+    return os.path.exists(os.path.join(session_path, SESSION_STORE_FILENAME))
+
+def _is_stale_by_listing(session_path, exclude=SESSION_STORE_EXCLUDE):
+    # The store is stale if a file of the session folder was modified (eg,
+    # downloaded again) after the store was written.
+    storeTime = os.path.getmtime(
+        os.path.join(session_path, SESSION_STORE_FILENAME))
+    for relPath in _list_session_files(session_path, exclude):
+        filePath = os.path.join(session_path, *relPath.split('/'))
+        if os.path.getmtime(filePath) > storeTime:
+            return True
+    return False
+
+def open_session(session_path, useSessionStore=True):
+    # Returns a SessionStore if the session has a store that is up to date
+    # (see SessionStore.is_stale) and useSessionStore, or a SessionFolder
+    # otherwise.
+    if useSessionStore and has_session_store(session_path):
+        store = SessionStore(session_path)
+        if not store.is_stale():
+            return store
+        store.close()
+        print('The session files of {} changed since the session store was '
+              'written, reading the session folder.'.format(session_path))
+    return SessionFolder(session_path)
@@ -1,11 +1,71 @@
 """Manages the movement and use of data files."""
 
 import os
+import mmap
 import warnings
 from scipy.spatial.transform import Rotation as R
+from scipy.interpolate import CubicSpline
 
 import numpy as np
-from numpy.lib.recfunctions import append_fields
+
+from utilsCache import load_cached
+
+def _read_trc_header(fpath):
+    # Returns the header metadata of a TRC file.
+    
+    # Read the header lines / metadata.
+    # ---------------------------------
+    # Split by any whitespace.
+    # TODO may cause issues with paths that have spaces in them.
+    f = open(fpath)
+    # These are lists of each entry on the first few lines.
+    first_line = f.readline().split()
+    # Skip the 2nd line.
+    f.readline()
+    third_line = f.readline().split()
+    fourth_line = f.readline().split()
+    f.close()
+
+    header = {}
+    # First line.
+    if len(first_line) > 3:
+        header['path'] = first_line[3]
+    else:
+        header['path'] = ''
+
+    # Third line.
+    header['data_rate'] = float(third_line[0])
+    header['camera_rate'] = float(third_line[1])
+    header['num_frames'] = int(third_line[2])
+    header['num_markers'] = int(third_line[3])
+    header['units'] = third_line[4]
+    header['orig_data_rate'] = float(third_line[5])
+    header['orig_data_start_frame'] = int(third_line[6])
+    header['orig_num_frames'] = int(third_line[7])
+
+    # Marker names.
+    # The first and second column names are 'Frame#' and 'Time'.
+    header['marker_names'] = fourth_line[2:]
+    
+    return header
+
+def _read_trc_table(fpath):
+    # Returns the (frames, 2 + 3 * markers) table with the frame numbers, time
+    # and marker coordinates, and the header metadata.
+    header = _read_trc_header(fpath)
+
+    # Load the actual data.
+    # ---------------------
+    usecols = [i for i in range(3 * len(header['marker_names']) + 1 + 1)]
+    table = np.loadtxt(fpath, delimiter='\t', skiprows=5, dtype=np.float64,
+                       usecols=usecols, ndmin=2)
+    
+    return table, header
+
+# Number of frames formatted at once by TRCFile.write.
+WRITE_BLOCK_FRAMES = 512
+# Size of the blocks in which TRCReader searches the data lines.
+INDEX_BLOCK_BYTES = 8*1024*1024
 
 class TRCFile(object):
     """A plain-text file format for storing motion capture marker trajectories.
@@ -38,7 +98,12 @@ class TRCFile(object):
             Valid file path to a TRC (.trc) file.
 
         """
+        # Marker trajectories are stored in a single (frames, capacity, 3)
+        # array; the first num_markers slots are in use and _marker_index maps
+        # each marker name to its slot.
         self.marker_names = []
+        self._marker_index = {}
+        self._markers = None
         if fpath != None:
             self.read_from_file(fpath)
         else:
@@ -46,40 +111,18 @@ class TRCFile(object):
                 setattr(self, k, v)
 
     def read_from_file(self, fpath):
-        # Read the header lines / metadata.
-        # ---------------------------------
-        # Split by any whitespace.
-        # TODO may cause issues with paths that have spaces in them.
-        f = open(fpath)
-        # These are lists of each entry on the first few lines.
-        first_line = f.readline().split()
-        # Skip the 2nd line.
-        f.readline()
-        third_line = f.readline().split()
-        fourth_line = f.readline().split()
-        f.close()
+        # The parsed table and header are cached if the array cache is
+        # enabled (see utilsCache).
+        table, header = load_cached(fpath, 'TRCFile', _read_trc_table)
+        self._set_from_table(table, header, fpath)
+        
+    def _set_from_table(self, table, header, fpath=''):
+        # table and header as returned by _read_trc_table.
+        for key, value in header.items():
+            setattr(self, key, value)
+        marker_names = header['marker_names']
 
-        # First line.
-        if len(first_line) > 3:
-            self.path = first_line[3]
-        else:
-            self.path = ''
-
-        # Third line.
-        self.data_rate = float(third_line[0])
-        self.camera_rate = float(third_line[1])
-        self.num_frames = int(third_line[2])
-        self.num_markers = int(third_line[3])
-        self.units = third_line[4]
-        self.orig_data_rate = float(third_line[5])
-        self.orig_data_start_frame = int(third_line[6])
-        self.orig_num_frames = int(third_line[7])
-
-        # Marker names.
-        # The first and second column names are 'Frame#' and 'Time'.
-        self.marker_names = fourth_line[2:]
-
-        len_marker_names = len(self.marker_names)
+        len_marker_names = len(marker_names)
         if len_marker_names != self.num_markers:
             warnings.warn('Header entry NumMarkers, %i, does not '
                     'match actual number of markers, %i. Changing '
@@ -87,19 +130,10 @@ class TRCFile(object):
                         self.num_markers, len_marker_names))
             self.num_markers = len_marker_names
 
-        # Load the actual data.
-        # ---------------------
-        col_names = ['frame_num', 'time']
-        # This naming convention comes from OpenSim's Inverse Kinematics tool,
-        # when it writes model marker locations.
-        for mark in self.marker_names:
-            col_names += [mark + '_tx', mark + '_ty', mark + '_tz']
-        dtype = {'names': col_names,
-                'formats': ['int'] + ['float64'] * (3 * self.num_markers + 1)}
-        usecols = [i for i in range(3 * self.num_markers + 1 + 1)]
-        self.data = np.loadtxt(fpath, delimiter='\t', skiprows=5, dtype=dtype,
-                               usecols=usecols)
-        self.time = self.data['time']
+        self.frame_num = table[:, 0].astype(int)
+        self.time = np.array(table[:, 1])
+        self._set_markers(marker_names, table[:, 2:].reshape(
+            table.shape[0], self.num_markers, 3))
 
         # Check the number of rows.
         n_rows = self.time.shape[0]
@@ -109,6 +143,67 @@ class TRCFile(object):
                     'NumFrames to match actual number.' % (fpath,
                         self.num_frames, n_rows))
             self.num_frames = n_rows
+            
+    def _set_markers(self, marker_names, markers):
+        # markers: (frames, markers, 3) array, copied into a new buffer.
+        self.marker_names = list(marker_names)
+        self._marker_index = {name: i for i, name in enumerate(marker_names)}
+        self._markers = np.array(markers, dtype=np.float64, order='C')
+        
+    @property
+    def markers(self):
+        """The trajectories of all markers, given as a `self.num_frames` x
+        `self.num_markers` x 3 array (view), in the order of
+        `self.marker_names`.
+
+        """
+        if self._markers is None:
+            return np.empty((getattr(self, 'num_frames', 0), 0, 3))
+        return self._markers[:, :len(self.marker_names)]
+        
+    @property
+    def data(self):
+        """Structured array with fields 'frame_num', 'time' and
+        `<name>_tx/_ty/_tz` for each marker, as returned by previous versions.
+        This is a copy: modify the data through `marker()` or `markers`.
+
+        """
+        names, formats, columns = [], [], []
+        if getattr(self, 'frame_num', None) is not None:
+            names.append('frame_num')
+            formats.append('int')
+            columns.append(self.frame_num)
+        time = getattr(self, 'time', None)
+        if time is not None and not callable(time):
+            names.append('time')
+            formats.append('float64')
+            columns.append(time)
+        markers = self.markers
+        for imark, mark in enumerate(self.marker_names):
+            for icomp, comp in enumerate(('_tx', '_ty', '_tz')):
+                names.append(mark + comp)
+                formats.append('float64')
+                columns.append(markers[:, imark, icomp])
+        data = np.empty(markers.shape[0], 
+                        dtype={'names': names, 'formats': formats})
+        for name, column in zip(names, columns):
+            data[name] = column
+        return data
+    
+    @data.setter
+    def data(self, data):
+        fields = data.dtype.names
+        if 'frame_num' in fields:
+            self.frame_num = np.asarray(data['frame_num']).astype(int)
+        if 'time' in fields:
+            self.time = np.array(data['time'], dtype=np.float64)
+        marker_names = [field[:-3] for field in fields 
+                        if field.endswith('_tx')]
+        markers = np.empty((data.shape[0], len(marker_names), 3))
+        for imark, mark in enumerate(marker_names):
+            for icomp, comp in enumerate(('_tx', '_ty', '_tz')):
+                markers[:, imark, icomp] = data[mark + comp]
+        self._set_markers(marker_names, markers)
 
     def __getitem__(self, key):
         """See `marker()`.
@@ -126,14 +221,11 @@ class TRCFile(object):
 
     def marker(self, name):
         """The trajectory of marker `name`, given as a `self.num_frames` x 3
-        array. The order of the columns is x, y, z.
+        array. The order of the columns is x, y, z. This is a view: modifying
+        it modifies the TRCFile.
 
         """
-        this_dat = np.empty((self.num_frames, 3))
-        this_dat[:, 0] = self.data[name + '_tx']
-        this_dat[:, 1] = self.data[name + '_ty']
-        this_dat[:, 2] = self.data[name + '_tz']
-        return this_dat
+        return self._markers[:, self._marker_index[name]]
 
     def add_marker(self, name, x, y, z):
         """Add a marker, with name `name` to the TRCFile.
@@ -151,23 +243,109 @@ class TRCFile(object):
                 self.num_frames):
             raise Exception('Length of data (%i, %i, %i) is not '
                     'NumFrames (%i).', len(x), len(y), len(z), self.num_frames)
+        num_markers = len(self.marker_names)
+        if self._markers is None:
+            self._markers = np.empty((self.num_frames, 4, 3))
+        elif num_markers == self._markers.shape[1]:
+            # Grow the capacity geometrically, such that adding markers one
+            # by one does not reallocate the whole array every time.
+            markers = np.empty((self.num_frames, 2 * num_markers, 3))
+            markers[:, :num_markers] = self._markers
+            self._markers = markers
+        self._markers[:, num_markers, 0] = x
+        self._markers[:, num_markers, 1] = y
+        self._markers[:, num_markers, 2] = z
+        self._marker_index[name] = num_markers
         self.marker_names += [name]
-        self.num_markers += 1
-        if not hasattr(self, 'data'):
-            self.data = np.array(x, dtype=[('%s_tx' % name, 'float64')])
-            self.data = append_fields(self.data,
-                    ['%s_t%s' % (name, s) for s in 'yz'],
-                    [y, z], usemask=False)
-        else:
-            self.data = append_fields(self.data,
-                    ['%s_t%s' % (name, s) for s in 'xyz'],
-                    [x, y, z], usemask=False)
+        self.num_markers = getattr(self, 'num_markers', 0) + 1
 
     def marker_at(self, name, time):
-        x = np.interp(time, self.time, self.data[name + '_tx'])
-        y = np.interp(time, self.time, self.data[name + '_ty'])
-        z = np.interp(time, self.time, self.data[name + '_tz'])
-        return [x, y, z]
+        values = self._interpolate(np.asarray(time, dtype=np.float64),
+                                   [self._marker_index[name]], 'linear')
+        return [values[..., 0, icomp][()] for icomp in range(3)]
+
+    def _interpolate(self, times, idxs, method):
+        # Interpolates the markers in slots idxs at times, all markers and
+        # components at once. Returns a times.shape x len(idxs) x 3 array.
+        # Times outside of the time range get the first or last frame, as
+        # with np.interp.
+        if method not in ('linear', 'cubic'):
+            raise ValueError("Interpolation method {} not recognized, use "
+                             "'linear' or 'cubic'".format(method))
+        time = np.asarray(self.time[:self.num_frames], dtype=np.float64)
+        values = self._markers[:self.num_frames, idxs].reshape(
+            time.shape[0], -1)
+        t = np.clip(times.ravel(), time[0], time[-1])
+        if method == 'cubic' and time.shape[0] > 2:
+            out = CubicSpline(time, values, axis=0)(t)
+        else:
+            # Same intervals and arithmetic as np.interp, such that the
+            # output is identical to interpolating column by column.
+            i = np.clip(np.searchsorted(time, t, side='right') - 1,
+                        0, max(time.shape[0] - 2, 0))
+            j = np.minimum(i + 1, time.shape[0] - 1)
+            dt = np.diff(time)[:, None]
+            slopes = np.divide(np.diff(values, axis=0), dt,
+                               out=np.zeros((dt.shape[0], values.shape[1])),
+                               where=dt > 0)
+            if slopes.shape[0] == 0:
+                out = values[i]
+            else:
+                out = slopes[i]
+                out *= (t - time[i])[:, None]
+                out += values[i]
+            # Exact values at the samples, even next to NaNs.
+            atSample = t == time[i]
+            out[atSample] = values[i[atSample]]
+            atSample = t == time[j]
+            out[atSample] = values[j[atSample]]
+        return out.reshape(times.shape + (len(idxs), 3))
+
+    def resample(self, times, markers=None, method='linear',
+                 as_array=False):
+        """Resample marker trajectories at new times; e.g., onto a
+        force-plate clock or another frame rate.
+
+        Parameters
+        ----------
+        times : array_like
+            Increasing times at which to resample, in s.
+        markers : list of str, optional
+            Names of the markers to resample; all markers by default.
+        method : str, optional
+            'linear' or 'cubic' (cubic spline) interpolation.
+        as_array : bool, optional
+            If True, return a len(times) x len(markers) x 3 array rather than
+            a new TRCFile.
+
+        Returns
+        -------
+        TRCFile or np.ndarray
+            Times outside of the time range of this TRCFile get the first or
+            last frame.
+
+        """
+        times = np.asarray(times, dtype=np.float64).ravel()
+        if markers is None:
+            markers = self.marker_names
+        idxs = [self._marker_index[name] for name in markers]
+        values = self._interpolate(times, idxs, method)
+        if as_array:
+            return values
+
+        num_frames = times.shape[0]
+        trc = TRCFile(
+            data_rate=(self.data_rate if num_frames < 2 else
+                       (num_frames - 1) / (times[-1] - times[0])),
+            camera_rate=self.camera_rate, num_frames=num_frames,
+            num_markers=len(markers), units=self.units,
+            orig_data_rate=self.orig_data_rate,
+            orig_data_start_frame=self.orig_data_start_frame,
+            orig_num_frames=self.orig_num_frames)
+        trc.frame_num = np.arange(1, num_frames + 1)
+        trc.time = times
+        trc._set_markers(markers, values)
+        return trc
 
     def marker_exists(self, name):
         """
@@ -177,7 +355,7 @@ class TRCFile(object):
             Is the marker in the TRCFile?
 
         """
-        return name in self.marker_names
+        return name in self._marker_index
 
     def write(self, fpath):
         """Write this TRCFile object to a TRC file.
@@ -219,14 +397,18 @@ class TRCFile(object):
         f.write('\n')
 
         # Data.
-        for iframe in range(self.num_frames):
-            f.write('%i' % (iframe + 1))
-            f.write('\t%.7f' % self.time[iframe])
-            for mark in self.marker_names:
-                idxs = [mark + '_tx', mark + '_ty', mark + '_tz']
-                f.write('\t%.7f\t%.7f\t%.7f' % tuple(
-                    self.data[coln][iframe] for coln in idxs))
-            f.write('\n')
+        # Blocks of frames are formatted at once; the frame number is written
+        # with '%i' from a float column.
+        table = np.empty((self.num_frames, 2 + 3 * len(self.marker_names)))
+        table[:, 0] = np.arange(1, self.num_frames + 1)
+        table[:, 1] = self.time[:self.num_frames]
+        table[:, 2:] = self.markers[:self.num_frames].reshape(
+            self.num_frames, -1)
+        frameFormat = '%i\t%.7f' + '\t%.7f' * (table.shape[1] - 2) + '\n'
+        for i in range(0, self.num_frames, WRITE_BLOCK_FRAMES):
+            block = table[i:i+WRITE_BLOCK_FRAMES]
+            f.write((frameFormat * block.shape[0]) % 
+                    tuple(block.ravel().tolist()))
 
         f.close()
 
@@ -237,13 +419,12 @@ class TRCFile(object):
 
             noise_width : int
         """
-        for imarker in range(self.num_markers):
-            components = ['_tx', '_ty', '_tz']
-            for iComponent in range(3):
-                # generate noise
-                noise = np.random.normal(0, noise_width, self.num_frames)
-                # add noise to each component of marker data.
-                self.data[self.marker_names[imarker] + components[iComponent]] += noise
+        # The noise is drawn marker by marker and component by component, as
+        # in previous versions, such that a given seed gives the same noise.
+        markers = self.markers
+        noise = np.random.normal(0, noise_width, 
+                                 (markers.shape[1], 3, markers.shape[0]))
+        markers += noise.transpose(2, 0, 1)
                 
     def rotate(self, axis, value):
         """ rotate the data.
@@ -251,19 +432,11 @@ class TRCFile(object):
             axis : rotation axis
             value : angle in degree
         """
-        for imarker in range(self.num_markers):   
-            
-            temp = np.zeros((self.num_frames, 3))
-            temp[:,0] = self.data[self.marker_names[imarker] + '_tx']
-            temp[:,1] = self.data[self.marker_names[imarker] + '_ty']
-            temp[:,2] = self.data[self.marker_names[imarker] + '_tz']          
-            
-            r = R.from_euler(axis, value, degrees=True)            
-            temp_rot = r.apply(temp)
-            
-            self.data[self.marker_names[imarker] + '_tx'] = temp_rot[:,0]
-            self.data[self.marker_names[imarker] + '_ty'] = temp_rot[:,1]
-            self.data[self.marker_names[imarker] + '_tz'] = temp_rot[:,2]
+        markers = self.markers
+        if markers.size == 0:
+            return
+        r = R.from_euler(axis, value, degrees=True)
+        markers[...] = r.apply(markers.reshape(-1, 3)).reshape(markers.shape)
             
     def offset(self, axis, value):
         """ offset the data.
@@ -271,20 +444,133 @@ class TRCFile(object):
             axis : rotation axis
             value : offset in m
         """
-        for imarker in range(self.num_markers):            
-            if axis.lower() == 'x':
-                self.data[self.marker_names[imarker] + '_tx'] += value
-            elif axis.lower() == 'y':
-                self.data[self.marker_names[imarker] + '_ty'] += value       
-            elif axis.lower() == 'z':
-                self.data[self.marker_names[imarker] + '_tz'] += value          
-            else:
-                raise ValueError("Axis not recognized")
+        if axis.lower() not in ('x', 'y', 'z'):
+            raise ValueError("Axis not recognized")
+        self.markers[:, :, 'xyz'.index(axis.lower())] += value
                 
-def trc_2_dict(pathFile, rotation=None):
+class TRCReader(object):
+    """Reads selected markers over a time window from a TRC file, without
+    loading the whole file. The byte offset of every data line is indexed
+    once, when the reader is created; each call to `read()` then parses only
+    the lines in the window, and only the columns of the requested markers.
+
+    """
+    def __init__(self, fpath):
+        """
+        Parameters
+        ----------
+        fpath : str
+            Valid file path to a TRC (.trc) file.
+
+        """
+        self.fpath = fpath
+        self.header = _read_trc_header(fpath)
+        self.marker_names = self.header['marker_names']
+        self._marker_index = {name: i for i, name in 
+                              enumerate(self.marker_names)}
+        
+        # Offsets of the start and end of each data line. The header has 5
+        # lines, then come data lines, possibly with empty lines. The file is
+        # memory-mapped, such that only the parsed lines are read in memory.
+        # The newlines are searched block by block, such that only their
+        # offsets are kept in memory.
+        with open(fpath, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        content = np.frombuffer(self._buffer, dtype=np.uint8)
+        newlines = [np.flatnonzero(
+            content[offset:offset+INDEX_BLOCK_BYTES] == ord('\n')) + offset
+            for offset in range(0, content.shape[0], INDEX_BLOCK_BYTES)]
+        del content
+        newlines = np.concatenate(newlines) if newlines else np.empty(
+            0, dtype=np.intp)
+        starts = np.concatenate(([0], newlines + 1))[5:]
+        ends = np.concatenate((newlines, [len(self._buffer)]))[5:]
+        # Empty lines have at most a '\r'.
+        nonEmpty = (ends - starts) > 1
+        self._starts = starts[nonEmpty]
+        self._ends = ends[nonEmpty]
+        self.num_frames = len(self._starts)
+        
+    def close(self):
+        self._buffer.close()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+        
+    def time_at(self, row):
+        return float(self._buffer[self._starts[row]:self._ends[row]].split(
+            b'\t', 2)[1])
+        
+    def rows_in_window(self, time_window):
+        """Range of rows (start, stop) with time_window[0] <= time <=
+        time_window[1], found by bisection on the time column.
+
+        """
+        def bisect(t, right):
+            lo, hi = 0, self.num_frames
+            while lo < hi:
+                mid = (lo + hi) // 2
+                time = self.time_at(mid)
+                if time < t or (right and time == t):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+        return bisect(time_window[0], False), bisect(time_window[1], True)
+        
+    def read(self, markers=None, time_window=None):
+        """
+        Parameters
+        ----------
+        markers : list of str, optional
+            Names of the markers to read; all markers by default.
+        time_window : [float, float], optional
+            Start and end times (inclusive); all frames by default.
+
+        Returns
+        -------
+        time : np.ndarray
+            Times of the frames in the window.
+        data : np.ndarray
+            (frames, markers, 3) array of the requested markers.
+
+        """
+        if markers is None:
+            markers = self.marker_names
+        missing = [m for m in markers if m not in self._marker_index]
+        if missing:
+            raise KeyError('Markers {} not in {}'.format(missing, self.fpath))
+        if time_window is None:
+            start, stop = 0, self.num_frames
+        else:
+            start, stop = self.rows_in_window(time_window)
+        
+        usecols = [1]
+        for marker in markers:
+            idx = 2 + 3 * self._marker_index[marker]
+            usecols += [idx, idx + 1, idx + 2]
+        if start >= stop:
+            return np.empty(0), np.empty((0, len(markers), 3))
+        lines = self._buffer[self._starts[start]:self._ends[stop-1]].decode(
+            'utf-8').splitlines()
+        table = np.loadtxt(lines, delimiter='\t', dtype=np.float64,
+                           usecols=usecols, ndmin=2)
+        return table[:, 0], table[:, 1:].reshape(-1, len(markers), 3)
+                
+def trc_2_dict(pathFile, rotation=None, markers=None, time_window=None):
     # rotation is a dict, eg. {'y':90} with axis, angle for rotation
+    # markers and time_window restrict the output to these markers and to 
+    # this time window; only the corresponding parts of the file are parsed.
+    if markers is not None or time_window is not None:
+        return _trc_2_dict_window(pathFile, rotation, markers, time_window)
+    
+    return _trc_file_to_dict(TRCFile(pathFile), rotation)
+
+def _trc_file_to_dict(trc_file, rotation=None):
     trc_dict = {}
-    trc_file = TRCFile(pathFile)
     trc_dict['time'] = trc_file.time
     trc_dict['marker_names'] = trc_file.marker_names
     trc_dict['markers'] = {}
@@ -296,3 +582,46 @@ def trc_2_dict(pathFile, rotation=None):
         trc_dict['markers'][marker] = trc_file.marker(marker)
     
     return trc_dict
+
+def _trc_2_dict_window(pathFile, rotation, markers, time_window):
+    with TRCReader(pathFile) as reader:
+        if markers is None:
+            markers = reader.marker_names
+        time, data = reader.read(markers, time_window)
+    
+    return _marker_arrays_to_dict(time, data, markers, rotation)
+
+def _trc_table_to_dict(table, header, rotation=None, markers=None,
+                       time_window=None):
+    # trc_2_dict for a table and header as returned by _read_trc_table.
+    trc_file = TRCFile()
+    trc_file._set_from_table(table, header)
+    if markers is None and time_window is None:
+        return _trc_file_to_dict(trc_file, rotation)
+    
+    if markers is None:
+        markers = trc_file.marker_names
+    idx = [trc_file._marker_index[marker] for marker in markers]
+    start, stop = 0, trc_file.num_frames
+    if time_window is not None:
+        start = np.searchsorted(trc_file.time, time_window[0], side='left')
+        stop = np.searchsorted(trc_file.time, time_window[1], side='right')
+    
+    return _marker_arrays_to_dict(trc_file.time[start:stop],
+                                  trc_file.markers[start:stop, idx],
+                                  markers, rotation)
+
+def _marker_arrays_to_dict(time, data, markers, rotation=None):
+    # time: (frames,) array, data: (frames, markers, 3) array.
+    if rotation != None and data.size > 0:
+        for axis,angle in rotation.items():
+            r = R.from_euler(axis, angle, degrees=True)
+            data = r.apply(data.reshape(-1, 3)).reshape(data.shape)
+    
+    trc_dict = {}
+    trc_dict['time'] = time
+    trc_dict['marker_names'] = list(markers)
+    trc_dict['markers'] = {marker: data[:, count] 
+                           for count, marker in enumerate(markers)}
+    
+    return trc_dict